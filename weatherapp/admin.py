@@ -3,8 +3,8 @@ from django.http import HttpResponseRedirect
 from django.urls import path
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from .models import Race, Location, Weather
-from . import services  # Import your services module
+from .models import Race, Location, Weather, Climatology, DailyWeather, Geocode, RefreshJob
+from . import jobs, services  # Import your services module
 
 
 class LocationAdmin(admin.ModelAdmin):
@@ -12,21 +12,15 @@ class LocationAdmin(admin.ModelAdmin):
     actions = ['get_lat_long']
 
     def get_lat_long(self, request, queryset):
-        success_count = 0
-        error_count = 0
-        
-        for location in queryset:
-            try:
-                services.get_coord(location)  
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                messages.error(request, f"Error fetching coord for {location.city}: {str(e)}")
-       
-        if success_count:
-            messages.success(request, f"Successfully fetched coords for {success_count} location(s)")
-        if error_count:
-            messages.error(request, f"Failed to fetch coords for {error_count} location(s)")
+        located, failed = services.geocode_locations(queryset)
+
+        for location, error in failed:
+            messages.error(request, f"Error fetching coord for {location.city}: {error}")
+
+        if located:
+            messages.success(request, f"Successfully fetched coords for {len(located)} location(s)")
+        if failed:
+            messages.error(request, f"Failed to fetch coords for {len(failed)} location(s)")
     
     get_lat_long.short_description = "Fetch coordinates for selected locations"
 
@@ -35,43 +29,63 @@ class RaceAdmin(admin.ModelAdmin):
     actions = ['fetch_weather_data', 'fetch_weather_forecast']
 
     def fetch_weather_data(self, request, queryset):
-        success_count = 0
-        error_count = 0
-
-        for race in queryset:
-            try:
-                services.get_save_historic_weather(race)
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                messages.error(request, f"Error fetching weather for {race.name}: {str(e)}")
-
-        if success_count:
-            messages.success(request, f"Successfully fetched weather for {success_count} location(s)")
-        if error_count:
-            messages.error(request, f"Failed to fetch weather for {error_count} location(s)")
+        self.enqueue_jobs(request, queryset, RefreshJob.Kind.HISTORIC)
     
     fetch_weather_data.short_description = "Fetch weather for selected races"
 
     def fetch_weather_forecast(self, request, queryset):
-        success_count = 0
-        error_count = 0
-
-        for race in queryset:
-            try:
-                services.get_save_forecast(race)
-                success_count += 1
-            except Exception as e:
-                error_count += 1
-                messages.error(request, f"Error fetching weather for {race.name}: {str(e)}")
-
-        if success_count:
-            messages.success(request, f"Successfully fetched weather for {success_count} location(s)")
-        if error_count:
-            messages.error(request, f"Failed to fetch weather for {error_count} location(s)")
+        self.enqueue_jobs(request, queryset, RefreshJob.Kind.FORECAST)
     
     fetch_weather_forecast.short_description = "Fetch forecast for selected races"
 
+    def enqueue_jobs(self, request, queryset, kind):
+        queued = jobs.enqueue(queryset, kind)
+        skipped = queryset.count() - len(queued)
+
+        if queued:
+            messages.success(request, f"Queued {len(queued)} weather job(s). Run 'manage.py process_weather_jobs' to process them")
+        if skipped:
+            messages.warning(request, f"Skipped {skipped} race(s) that already have a job waiting")
+
+class ClimatologyAdmin(admin.ModelAdmin):
+    list_display = ['location', 'month', 'day', 'hour', 'count', 'temp', 'temp_p10', 'temp_p90', 'humidity', 'precip_prob']
+    list_filter = ['location']
+    list_select_related = ['location']
+
+class DailyWeatherAdmin(admin.ModelAdmin):
+    list_display = ['location', 'date', 'hours', 'temp_min', 'temp_max', 'precip']
+    list_filter = ['location']
+    list_select_related = ['location']
+
+class GeocodeAdmin(admin.ModelAdmin):
+    list_display = ['city', 'state', 'country', 'lat', 'long', 'resolved_at']
+    search_fields = ['city', 'state', 'country']
+
+class RefreshJobAdmin(admin.ModelAdmin):
+    list_display = ['race', 'kind', 'status', 'created_at', 'duration', 'rows_inserted', 'rows_updated', 'error']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['race', 'kind', 'status', 'created_at', 'started_at', 'finished_at', 'rows_inserted', 'rows_updated', 'error']
+    list_select_related = ['race']
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        # A running job still has a worker on it; requeueing would run it twice
+        count = queryset.exclude(status=RefreshJob.Status.RUNNING).update(
+            status=RefreshJob.Status.QUEUED, started_at=None, finished_at=None, error=''
+        )
+        skipped = queryset.count() - count
+
+        if count:
+            messages.success(request, f"Requeued {count} job(s)")
+        if skipped:
+            messages.warning(request, f"Skipped {skipped} running job(s)")
+
+    requeue.short_description = "Requeue selected jobs"
+
 admin.site.register(Location, LocationAdmin)
 admin.site.register(Race, RaceAdmin)
-admin.site.register(Weather)
\ No newline at end of file
+admin.site.register(Weather)
+admin.site.register(Climatology, ClimatologyAdmin)
+admin.site.register(DailyWeather, DailyWeatherAdmin)
+admin.site.register(Geocode, GeocodeAdmin)
+admin.site.register(RefreshJob, RefreshJobAdmin)
\ No newline at end of file
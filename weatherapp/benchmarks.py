@@ -0,0 +1,238 @@
+import io
+import json
+import statistics
+import time
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from . import services, views
+from .models import Location, Race, Weather
+
+
+# Generated locations are marked with this state so they can be found and cleared again
+BENCH_STATE = 'Benchmark'
+
+
+# Columns written by insert_weather, in the order of the synthetic_weather tuples
+INSERT_COLUMNS = ['location_id', 'datetime', 'is_forecast', *services.WEATHER_FIELDS]
+
+
+def synthetic_columns(timestamps, rng):
+    """
+    Hourly weather at the given UNIX timestamps, as {field: array} over WEATHER_FIELDS: a yearly
+    and daily temperature cycle plus noise and occasional rain, rounded the way Open-Meteo
+    values are stored.
+    """
+    hours = len(timestamps)
+    day_of_year = (timestamps / 86400) % 365.25
+    hour_of_day = (timestamps / 3600) % 24
+
+    temp = 55 - 25 * np.cos(2 * np.pi * (day_of_year - 15) / 365.25) - 8 * np.cos(2 * np.pi * (hour_of_day - 3) / 24) + rng.normal(0, 4, hours)
+    humidity = np.clip(70 - (temp - 55) / 2 + rng.normal(0, 12, hours), 5, 100)
+    raining = rng.random(hours) < 0.08
+    rain = np.where(raining, rng.exponential(0.05, hours), 0)
+    wind_speed = rng.gamma(2, 4, hours)
+
+    return {
+        'temp': np.round(temp, 1),
+        'humidity': np.round(humidity).astype(int),
+        'rain': np.round(rain, 2),
+        'precip_prob': np.round(np.clip(np.where(raining, 70, 10) + rng.normal(0, 10, hours), 0, 100)),
+        'precip': np.round(rain, 2),
+        'showers': np.zeros(hours),
+        'snowfall': np.round(np.where(temp < 32, rain * 0.7, 0), 2),
+        'wind_speed': np.round(wind_speed, 2),
+        'wind_direction': np.round(rng.uniform(0, 360, hours)),
+        'wind_gusts': np.round(wind_speed * rng.uniform(1.2, 1.8, hours), 2),
+    }
+
+
+def synthetic_weather(location, start, hours, rng):
+    """synthetic_columns for a location, hourly from start, as INSERT_COLUMNS tuples"""
+    timestamps = int(start.timestamp()) + np.arange(hours) * 3600
+    columns = synthetic_columns(timestamps, rng)
+
+    adapt = connection.ops.adapt_datetimefield_value
+    return [
+        (location.pk, adapt(datetime.fromtimestamp(ts, tz=dt_timezone.utc)), False, *row)
+        for ts, *row in zip(timestamps.tolist(), *(columns[field].tolist() for field in services.WEATHER_FIELDS))
+    ]
+
+
+def insert_weather(rows, batch_size=10000):
+    """
+    Insert synthetic_weather tuples with executemany. Skipping model instances makes this
+    several times faster than bulk_create, which matters at tens of millions of rows.
+    """
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        connection.ops.quote_name(Weather._meta.db_table),
+        ', '.join(connection.ops.quote_name(column) for column in INSERT_COLUMNS),
+        ', '.join(['%s'] * len(INSERT_COLUMNS))
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[i:i + batch_size])
+
+
+def seed(locations=500, years=10, races_per_location=1, seed=0, batch_size=10000, stdout=None):
+    """
+    Create benchmark locations with hourly Weather for every day of the last `years` full
+    years, and races on a day of the last seeded year. Climatology is computed over all of
+    those years, for the race days only, which is all the benchmarks read. Returns the
+    created locations.
+    """
+    rng = np.random.default_rng(seed)
+    last_year = date.today().year - 1
+    start = datetime(last_year - years + 1, 1, 1, tzinfo=dt_timezone.utc)
+    hours = int((datetime(last_year + 1, 1, 1, tzinfo=dt_timezone.utc) - start).total_seconds() // 3600)
+
+    first = Location.objects.filter(state=BENCH_STATE).count()
+    created = []
+    for i in range(first, first + locations):
+        location = Location.objects.create(
+            city=f"Bench City {i}", state=BENCH_STATE, country='Benchland',
+            lat=round(rng.uniform(25, 48), 5), long=round(rng.uniform(-124, -67), 5)
+        )
+        insert_weather(synthetic_weather(location, start, hours, rng), batch_size)
+
+        races = Race.objects.bulk_create([
+            Race(
+                name=f"Bench Race {i}-{n}", slug=f"bench-race-{i}-{n}", length='26.2', location=location,
+                date=datetime(last_year, (i + n) % 12 + 1, 15, 12, tzinfo=dt_timezone.utc)
+            )
+            for n in range(races_per_location)
+        ])
+
+        with redirect_stdout(io.StringIO()):
+            services.refresh_climatology(location, {(race.date.month, race.date.day) for race in races}, start_year=start.year)
+
+        created.append(location)
+        if stdout:
+            stdout.write(f"[{i - first + 1}/{locations}] {location}: {hours} hours")
+
+    return created
+
+
+def clear():
+    """Delete the benchmark locations with their races and weather"""
+    return Location.objects.filter(state=BENCH_STATE).delete()
+
+
+class Rollback(Exception):
+    pass
+
+
+def measure(run, repeat, before=None, rollback=False):
+    """
+    Call run() `repeat` times. Returns the median and best seconds and the query count of the
+    last call. before() runs untimed ahead of each call; with rollback, each call's writes
+    are undone.
+    """
+    timings = []
+    queries = None
+    for _ in range(repeat):
+        if before:
+            before()
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            try:
+                with transaction.atomic():
+                    run()
+                    if rollback:
+                        raise Rollback
+            except Rollback:
+                pass
+            timings.append(time.perf_counter() - started)
+        queries = len(captured)
+
+    return {'seconds': statistics.median(timings), 'best': min(timings), 'queries': queries}
+
+
+def run(repeat=5):
+    """
+    Time the race page (rendered and cached), the index, the climatology branch of
+    get_save_forecast, a historic ingestion write and reading a year of Weather into a NumPy
+    array on the benchmark data, reading history over every seeded year.
+    Returns {name: {'seconds', 'best', 'queries'}}.
+    """
+    race = Race.objects.select_related('location').filter(location__state=BENCH_STATE).order_by('pk').first()
+    if race is None:
+        raise ValueError("No benchmark data; run seed_weather first")
+    location = race.location
+    first_year = Weather.objects.filter(location=location).earliest('datetime').datetime.year
+
+    factory = RequestFactory()
+    index = async_to_sync(views.index)
+    race_weather = async_to_sync(views.race_weather)
+
+    # Far enough out that the forecast comes from the climatology, without touching the network
+    future_race = Race(name=race.name, location=location, date=race.date.replace(year=date.today().year + 1))
+
+    # A week of stored history, rewritten as the historic fetch would
+    week = datetime(race.date.year, race.date.month, 1, tzinfo=dt_timezone.utc)
+    history = list(Weather.objects.filter(location=location, datetime__gte=week, datetime__lt=week + timedelta(days=7)))
+
+    # A year of hourly rows, read the way weather_stats and the JSON API read them
+    year_rows = Weather.objects.filter(
+        location=location,
+        datetime__gte=datetime(race.date.year, 1, 1, tzinfo=dt_timezone.utc),
+        datetime__lt=datetime(race.date.year + 1, 1, 1, tzinfo=dt_timezone.utc)
+    ).values_list(*services.WEATHER_FIELDS)
+
+    def race_page():
+        return race_weather(factory.get(f'/weatherapp/race/{race.slug}'), slug=race.slug, start_year=first_year)
+
+    def forget_page():
+        location.refresh_from_db()
+        cache.delete(views.race_page_cache_key(race, first_year))
+
+    # The seeded races are all in the past, so that is the listing with rows to render
+    index_request = factory.get('/weatherapp/', {'when': 'past'})
+    if b'Bench Race' not in index(index_request).content:
+        raise ValueError("The benchmark races are missing from the past race index")
+
+    results = {}
+    # The services print progress as they go
+    with redirect_stdout(io.StringIO()):
+        results['index'] = measure(lambda: index(index_request), repeat)
+        results['race_weather'] = measure(race_page, repeat, before=forget_page)
+        results['race_weather.cached'] = measure(race_page, repeat)
+        results['forecast.climatology'] = measure(lambda: services.get_save_forecast(future_race), repeat, rollback=True)
+        results['ingest.historic'] = measure(lambda: services.save_weather(location, history, kind='historic'), repeat, rollback=True)
+        results['convert.weather'] = measure(lambda: np.array(list(year_rows.all()), dtype=np.float64), repeat)
+
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, timings=True):
+    """
+    Regressions of results against a baseline: any benchmark making more queries, or, with
+    timings, whose median time grew by more than `tolerance`. Returns a list of messages.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        result = results.get(name)
+        if result is None:
+            continue
+        if result['queries'] > expected['queries']:
+            regressions.append(f"{name}: {result['queries']} queries, baseline {expected['queries']}")
+        if timings and result['seconds'] > expected['seconds'] * (1 + tolerance):
+            regressions.append(f"{name}: {result['seconds'] * 1000:.1f}ms, baseline {expected['seconds'] * 1000:.1f}ms")
+    return regressions
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -0,0 +1,198 @@
+import threading
+from collections import Counter, OrderedDict
+from datetime import date, timedelta
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.core.cache import caches
+from requests_cache import NEVER_EXPIRE
+from requests_cache.backends import BaseCache, init_backend
+from requests_cache.backends.base import BaseStorage
+
+
+class CacheStats:
+    """Thread-safe hit/miss counters, keyed like 'forecast.hit' or 'memory.miss'"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    def record(self, name, hit):
+        with self.lock:
+            self.counts[f"{name}.{'hit' if hit else 'miss'}"] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+
+
+stats = CacheStats()
+
+
+def endpoint(url):
+    """Which Open-Meteo API a URL belongs to: 'geocoding', 'historic' or 'forecast'"""
+    # The configured endpoints first, which may all be on one host (e.g. fake_openmeteo)
+    if url.startswith(settings.OPENMETEO_GEOCODING_URL):
+        return 'geocoding'
+    if url.startswith(settings.OPENMETEO_HISTORIC_URL):
+        return 'historic'
+    if url.startswith(settings.OPENMETEO_FORECAST_URL):
+        return 'forecast'
+
+    host = urlparse(url).hostname or ''
+    if host.startswith('geocoding-api'):
+        return 'geocoding'
+    if host.startswith('historical-forecast-api'):
+        return 'historic'
+    return 'forecast'
+
+
+def expire_after(url, params=None):
+    """
+    Cache lifetime for a request. History that ended more than OPENMETEO_HISTORY_FINAL_DAYS ago
+    will not change again so it never expires; everything else uses the endpoint's TTL.
+    """
+    kind = endpoint(url)
+
+    if kind == 'historic' and params and params.get('end_date'):
+        end_date = params['end_date']
+        if isinstance(end_date, str):
+            end_date = date.fromisoformat(end_date)
+        if end_date < date.today() - timedelta(days=settings.OPENMETEO_HISTORY_FINAL_DAYS):
+            return NEVER_EXPIRE
+
+    return settings.OPENMETEO_CACHE_TTL[kind]
+
+
+class MemoryTier(BaseStorage):
+    """
+    Bounded in-memory LRU in front of a persistent response storage. Reads are served from
+    memory when possible and fall through to the backend otherwise; writes go to both.
+    """
+
+    def __init__(self, back, maxsize):
+        super().__init__()
+        self.back = back
+        self.serializer = back.serializer
+        self.maxsize = maxsize
+        self.front = OrderedDict()
+        self.front_lock = threading.RLock()
+
+    def __getattr__(self, name):
+        # Backend-specific helpers (db_path, bulk_commit, ...) still work through the wrapper
+        if name == 'back':
+            raise AttributeError(name)
+        return getattr(self.back, name)
+
+    def _remember(self, key, value):
+        with self.front_lock:
+            self.front[key] = value
+            self.front.move_to_end(key)
+            while len(self.front) > self.maxsize:
+                self.front.popitem(last=False)
+
+    def __getitem__(self, key):
+        with self.front_lock:
+            value = self.front.get(key)
+            if value is not None:
+                self.front.move_to_end(key)
+        stats.record('memory', value is not None)
+
+        if value is None:
+            value = self.back[key]
+            self._remember(key, value)
+        else:
+            # Same as requests-cache's own in-memory storage: rewind the body for reuse
+            if getattr(value, 'raw', None):
+                value.raw.reset()
+            value.cache_key = key
+
+        return value
+
+    def __setitem__(self, key, value):
+        self.back[key] = value
+        self._remember(key, value)
+
+    def __delitem__(self, key):
+        with self.front_lock:
+            self.front.pop(key, None)
+        del self.back[key]
+
+    def __iter__(self):
+        return iter(self.back)
+
+    def __len__(self):
+        return len(self.back)
+
+    def bulk_delete(self, keys):
+        keys = list(keys)
+        with self.front_lock:
+            for key in keys:
+                self.front.pop(key, None)
+        self.back.bulk_delete(keys)
+
+    def clear(self):
+        with self.front_lock:
+            self.front.clear()
+        self.back.clear()
+
+    def close(self):
+        self.back.close()
+
+
+class DjangoCacheStorage(BaseStorage):
+    """Response storage in one of the Django caches from CACHES. Keys can't be listed"""
+
+    def __init__(self, alias, prefix, serializer='pickle', **kwargs):
+        super().__init__(serializer=serializer, **kwargs)
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        value = self.cache.get(self.prefix + key)
+        if value is None:
+            raise KeyError(key)
+        return self.deserialize(key, value)
+
+    def __setitem__(self, key, value):
+        self.cache.set(self.prefix + key, self.serialize(value), timeout=None)
+
+    def __delitem__(self, key):
+        if not self.cache.delete(self.prefix + key):
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(())
+
+    def __len__(self):
+        return 0
+
+
+class DjangoCache(BaseCache):
+    """requests-cache backend storing responses in a Django cache"""
+
+    def __init__(self, cache_name, alias='default', **kwargs):
+        super().__init__(cache_name=cache_name, **kwargs)
+        self.responses = DjangoCacheStorage(alias, f"{cache_name}:responses:", **kwargs)
+        self.redirects = DjangoCacheStorage(alias, f"{cache_name}:redirects:", **kwargs)
+
+
+def build_backend():
+    """
+    Response cache for the shared session: OPENMETEO_CACHE_BACKEND ('sqlite', 'filesystem',
+    'memory' or 'django'), fronted by an in-memory LRU of OPENMETEO_CACHE_MEMORY_SIZE responses.
+    """
+    name = settings.OPENMETEO_CACHE_BACKEND
+    if name == 'django':
+        backend = DjangoCache(settings.OPENMETEO_CACHE_NAME, alias=settings.OPENMETEO_DJANGO_CACHE)
+    else:
+        backend = init_backend(settings.OPENMETEO_CACHE_NAME, name)
+
+    if settings.OPENMETEO_CACHE_MEMORY_SIZE:
+        backend.responses = MemoryTier(backend.responses, settings.OPENMETEO_CACHE_MEMORY_SIZE)
+
+    return backend
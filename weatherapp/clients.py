@@ -0,0 +1,124 @@
+import asyncio
+import threading
+import weakref
+
+import niquests
+import openmeteo_requests
+import requests_cache
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from . import cache, metrics
+
+
+_lock = threading.Lock()
+_session = None
+_client = None
+# AsyncSessions belong to the event loop they were opened on, so async clients are kept per loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class CachedSession(requests_cache.CachedSession):
+    """
+    requests-cache session that applies a default timeout to every request, picks the
+    cache lifetime per endpoint, counts cache hits and misses and times each request.
+    """
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+
+    def request(self, method, url, *args, params=None, expire_after=None, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if expire_after is None:
+            expire_after = cache.expire_after(url, params)
+
+        with metrics.timer('http', endpoint=cache.endpoint(url)):
+            response = super().request(method, url, *args, params=params, expire_after=expire_after, **kwargs)
+        cache.stats.record(cache.endpoint(url), getattr(response, 'from_cache', False))
+        return response
+
+
+def build_session():
+    """Cached session with retries and a keep-alive connection pool sized from settings"""
+    session = CachedSession(
+        backend=cache.build_backend(),
+        timeout=settings.OPENMETEO_TIMEOUT
+    )
+
+    retries = Retry(
+        total=settings.OPENMETEO_RETRIES,
+        backoff_factor=0.2,
+        status_forcelist=(500, 502, 504),
+        allowed_methods=None
+    )
+    adapter = HTTPAdapter(
+        max_retries=retries,
+        pool_connections=settings.OPENMETEO_POOL_SIZE,
+        pool_maxsize=settings.OPENMETEO_POOL_SIZE
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def get_session():
+    """Process-wide HTTP session. The cache backend is opened once, on first use"""
+    global _session
+    if _session is None:
+        with _lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def get_client():
+    """Process-wide Open-Meteo client sharing the pooled session"""
+    global _client
+    if _client is None:
+        session = get_session()
+        with _lock:
+            if _client is None:
+                _client = openmeteo_requests.Client(session=session)
+    return _client
+
+
+def build_async_session():
+    """
+    niquests AsyncSession with the same timeout, retries and pool size as the sync session.
+    It does not go through the requests-cache response cache.
+    """
+    retries = niquests.RetryConfiguration(
+        total=settings.OPENMETEO_RETRIES,
+        backoff_factor=0.2,
+        status_forcelist=(500, 502, 504),
+        allowed_methods=None
+    )
+    return niquests.AsyncSession(
+        retries=retries,
+        pool_connections=settings.OPENMETEO_POOL_SIZE,
+        pool_maxsize=settings.OPENMETEO_POOL_SIZE,
+        timeout=settings.OPENMETEO_TIMEOUT
+    )
+
+
+def get_async_client():
+    """Open-Meteo AsyncClient for the running event loop, for fetches made from async views"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = openmeteo_requests.AsyncClient(session=build_async_session())
+    return client
+
+
+def reset():
+    """Close the shared session so the next call builds a new one, e.g. after a fork or a settings change"""
+    global _session, _client
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _client = None
+        _async_clients.clear()
@@ -0,0 +1,216 @@
+"""
+Local stand-in for the Open-Meteo forecast, historical-forecast and geocoding APIs, for driving
+ingestion offline. Weather comes back as FlatBuffers in the format openmeteo_requests decodes,
+filled with benchmarks.synthetic_columns; geocoding answers JSON from a dict of known places.
+Latency, server errors and 429s can be injected.
+"""
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import flatbuffers
+import numpy as np
+from openmeteo_sdk.Unit import Unit
+from openmeteo_sdk.Variable import Variable
+
+from . import benchmarks, services
+
+
+# Open-Meteo variable name -> (Variable, altitude, Unit). Units are those weatherapp asks for
+VARIABLES = {
+    'temperature_2m': (Variable.temperature, 2, Unit.fahrenheit),
+    'relative_humidity_2m': (Variable.relative_humidity, 2, Unit.percentage),
+    'rain': (Variable.rain, 0, Unit.millimetre),
+    'precipitation_probability': (Variable.precipitation_probability, 0, Unit.percentage),
+    'precipitation': (Variable.precipitation, 0, Unit.millimetre),
+    'showers': (Variable.showers, 0, Unit.millimetre),
+    'snowfall': (Variable.snowfall, 0, Unit.centimetre),
+    'wind_speed_10m': (Variable.wind_speed, 10, Unit.miles_per_hour),
+    'wind_direction_10m': (Variable.wind_direction, 10, Unit.degree_direction),
+    'wind_gusts_10m': (Variable.wind_gusts, 10, Unit.miles_per_hour),
+}
+FIELDS = dict(zip(services.HOURLY_VARIABLES, services.WEATHER_FIELDS))
+
+
+def build_weather_response(latitude, longitude, start, hours, variables, seed=0):
+    """
+    One size-prefixed WeatherApiResponse with hourly values from start (UNIX seconds).
+    The values depend only on the coordinates, start and seed, so repeated requests match.
+    """
+    timestamps = start + np.arange(hours) * 3600
+    rng = np.random.default_rng([seed, zlib.crc32(f"{latitude:.5f},{longitude:.5f}".encode()), start])
+    columns = benchmarks.synthetic_columns(timestamps, rng)
+
+    builder = flatbuffers.Builder(1024 + hours * len(variables) * 4)
+
+    # Nested tables and vectors are written before the tables that point at them
+    offsets = []
+    for name in variables:
+        variable, altitude, unit = VARIABLES.get(name, (Variable.undefined, 0, Unit.undefined))
+        values = columns[FIELDS[name]] if name in FIELDS else np.zeros(hours)
+        values_offset = builder.CreateNumpyVector(np.asarray(values, dtype=np.float32))
+
+        builder.StartObject(12)
+        builder.PrependUint8Slot(0, variable, 0)
+        builder.PrependUint8Slot(1, unit, 0)
+        builder.PrependUOffsetTRelativeSlot(3, values_offset, 0)
+        builder.PrependInt16Slot(5, altitude, 0)
+        offsets.append(builder.EndObject())
+
+    builder.StartVector(4, len(offsets), 4)
+    for offset in reversed(offsets):
+        builder.PrependUOffsetTRelative(offset)
+    variables_offset = builder.EndVector()
+
+    builder.StartObject(4)
+    builder.PrependInt64Slot(0, start, 0)
+    builder.PrependInt64Slot(1, start + hours * 3600, 0)
+    builder.PrependInt32Slot(2, 3600, 0)
+    builder.PrependUOffsetTRelativeSlot(3, variables_offset, 0)
+    hourly_offset = builder.EndObject()
+
+    builder.StartObject(14)
+    builder.PrependFloat32Slot(0, latitude, 0)
+    builder.PrependFloat32Slot(1, longitude, 0)
+    builder.PrependFloat32Slot(3, 0.5, 0)
+    builder.PrependUOffsetTRelativeSlot(11, hourly_offset, 0)
+    builder.FinishSizePrefixed(builder.EndObject())
+
+    return bytes(builder.Output())
+
+
+def query_list(query, name):
+    """A query parameter as a list, whether repeated (a=1&a=2) or comma-separated (a=1,2)"""
+    return [item for value in query.get(name, []) for item in value.split(',') if item]
+
+
+def weather_body(query, seed=0):
+    """The FlatBuffers body for a forecast or historical-forecast query"""
+    latitudes = [float(value) for value in query_list(query, 'latitude')]
+    longitudes = [float(value) for value in query_list(query, 'longitude')]
+    if not latitudes or len(latitudes) != len(longitudes):
+        raise ValueError("latitude and longitude must be given in pairs")
+
+    start_date = date.fromisoformat(query['start_date'][0]) if 'start_date' in query else date.today()
+    end_date = date.fromisoformat(query['end_date'][0]) if 'end_date' in query else start_date + timedelta(days=6)
+    start = int(datetime.combine(start_date, datetime.min.time(), tzinfo=dt_timezone.utc).timestamp())
+    hours = ((end_date - start_date).days + 1) * 24
+
+    variables = query_list(query, 'hourly')
+    return b''.join(
+        build_weather_response(latitude, longitude, start, hours, variables, seed)
+        for latitude, longitude in zip(latitudes, longitudes)
+    )
+
+
+def geocoding_body(query, places):
+    """JSON search results for the name, from places: {lowercase name: [result, ...]}"""
+    name = query.get('name', [''])[0].strip().lower()
+    count = int(query.get('count', ['10'])[0])
+    results = places.get(name, [])[:count]
+    return json.dumps({'results': results, 'generationtime_ms': 0.1} if results else {'generationtime_ms': 0.1}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if server.latency or server.jitter:
+            time.sleep(max(0, server.latency + server.random(-server.jitter, server.jitter)))
+
+        if server.roll(server.throttle_rate):
+            return self.respond(429, json.dumps({'error': True, 'reason': 'Too many requests'}).encode(), 'application/json', {'Retry-After': str(server.retry_after)})
+        if server.roll(server.error_rate):
+            return self.respond(500, json.dumps({'error': True, 'reason': 'Injected error'}).encode(), 'application/json')
+
+        try:
+            if url.path.endswith('/search'):
+                return self.respond(200, geocoding_body(query, server.places), 'application/json')
+            return self.respond(200, weather_body(query, server.seed), 'application/octet-stream')
+        except (KeyError, ValueError) as e:
+            return self.respond(400, json.dumps({'error': True, 'reason': str(e)}).encode(), 'application/json')
+
+    def respond(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(status)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeOpenMeteoServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server answering weather queries on any path and geocoding on paths ending in
+    /search. error_rate and throttle_rate are the fractions of requests failed with a 500 or a
+    429; latency and jitter are in seconds.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), places=None, latency=0, jitter=0, error_rate=0,
+                 throttle_rate=0, retry_after=1, seed=0, verbose=False):
+        super().__init__(address, Handler)
+        self.places = places or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.responses = {}
+
+    def random(self, low, high):
+        with self.lock:
+            return self.rng.uniform(low, high)
+
+    def roll(self, rate):
+        return rate > 0 and self.random(0, 1) < rate
+
+    def count(self, status):
+        with self.lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def urls(self):
+        """OPENMETEO_*_URL settings pointing at this server"""
+        return {
+            'OPENMETEO_FORECAST_URL': f"{self.base_url}/v1/forecast",
+            'OPENMETEO_HISTORIC_URL': f"{self.base_url}/historical/v1/forecast",
+            'OPENMETEO_GEOCODING_URL': f"{self.base_url}/geocoding/v1/search",
+        }
+
+
+def places_from_locations(locations):
+    """Geocoding results for the given locations, at their stored coordinates"""
+    places = {}
+    for location in locations:
+        places.setdefault(location.city.strip().lower(), []).append({
+            'name': location.city,
+            'latitude': float(location.lat),
+            'longitude': float(location.long),
+            'admin1': location.state,
+            'country': location.country,
+        })
+    return places
@@ -0,0 +1,128 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import refresh, services
+from .models import RefreshJob
+
+
+FETCHERS = {
+    RefreshJob.Kind.HISTORIC: services.get_save_historic_weather,
+    RefreshJob.Kind.FORECAST: services.get_save_forecast,
+}
+
+# Kinds fetched once per location for all of its queued races, with their dates merged
+LOCATION_FETCHERS = {
+    RefreshJob.Kind.HISTORIC: services.get_save_location_history,
+}
+
+
+def fail_stuck_jobs():
+    """
+    Mark jobs running for longer than REFRESH_JOB_TIMEOUT as failed. Their worker died before
+    recording an outcome, and until then enqueue would skip their races.
+    Returns the number of jobs failed.
+    """
+    now = timezone.now()
+    return RefreshJob.objects.filter(
+        status=RefreshJob.Status.RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.REFRESH_JOB_TIMEOUT)
+    ).update(
+        status=RefreshJob.Status.FAILED, finished_at=now,
+        error=f"Still running after {settings.REFRESH_JOB_TIMEOUT}s; the worker presumably stopped"
+    )
+
+
+def enqueue(races, kind):
+    """Queue a refresh job per race, skipping races that already have one waiting or running"""
+    fail_stuck_jobs()
+    pending = RefreshJob.objects.filter(
+        kind=kind,
+        status__in=[RefreshJob.Status.QUEUED, RefreshJob.Status.RUNNING]
+    ).values_list('race_id', flat=True)
+
+    races = [race for race in races if race.pk not in set(pending)]
+    return RefreshJob.objects.bulk_create([RefreshJob(race=race, kind=kind) for race in races])
+
+
+def claim_jobs(limit):
+    """
+    Mark up to `limit` of the oldest queued jobs as running and return them.
+    Safe to call from several workers at once: a job only goes to the worker whose
+    update moved it out of the queued state.
+    """
+    fail_stuck_jobs()
+    with transaction.atomic():
+        candidates = list(
+            RefreshJob.objects.select_for_update(skip_locked=True)
+            .filter(status=RefreshJob.Status.QUEUED)
+            .order_by('created_at', 'pk')
+            .values_list('pk', flat=True)[:limit]
+        )
+
+        claimed = []
+        now = timezone.now()
+        for pk in candidates:
+            if RefreshJob.objects.filter(pk=pk, status=RefreshJob.Status.QUEUED).update(
+                status=RefreshJob.Status.RUNNING, started_at=now
+            ):
+                claimed.append(pk)
+
+    return list(RefreshJob.objects.filter(pk__in=claimed).select_related('race__location'))
+
+
+def run_jobs(jobs, max_workers=None):
+    """
+    Run claimed jobs through the refresh engine and record the outcome of each. If the run
+    is interrupted, the jobs without an outcome yet are marked failed before re-raising.
+    """
+    by_kind = defaultdict(list)
+    for job in jobs:
+        by_kind[job.kind].append(job)
+
+    recorded = set()
+    try:
+        for kind, kind_jobs in by_kind.items():
+            races = [job.race for job in kind_jobs]
+            if kind in LOCATION_FETCHERS:
+                results = refresh.refresh_locations(races, LOCATION_FETCHERS[kind], max_workers=max_workers)
+            else:
+                results = refresh.refresh_races(races, FETCHERS[kind], max_workers=max_workers)
+
+            # Results come back in the order the races were passed in
+            for job, (race, result, error) in zip(kind_jobs, results):
+                job.finished_at = timezone.now()
+                if error is None:
+                    job.status = RefreshJob.Status.DONE
+                    job.rows_inserted, job.rows_updated = result
+                else:
+                    job.status = RefreshJob.Status.FAILED
+                    job.error = str(error)
+
+            RefreshJob.objects.bulk_update(
+                kind_jobs, ['status', 'finished_at', 'rows_inserted', 'rows_updated', 'error']
+            )
+            recorded.update(job.pk for job in kind_jobs)
+
+    except BaseException as e:
+        # Also on KeyboardInterrupt: jobs left running would block their races from being queued
+        unrecorded = [job for job in jobs if job.pk not in recorded]
+        for job in unrecorded:
+            job.status = RefreshJob.Status.FAILED
+            job.finished_at = timezone.now()
+            job.error = f"Interrupted: {e!r}"
+        RefreshJob.objects.bulk_update(unrecorded, ['status', 'finished_at', 'error'])
+        raise
+
+    return jobs
+
+
+def run_pending(limit, max_workers=None):
+    """Claim and run one batch of queued jobs. Returns the jobs that ran"""
+    jobs = claim_jobs(limit)
+    if jobs:
+        run_jobs(jobs, max_workers=max_workers)
+    return jobs
@@ -0,0 +1,162 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weatherapp import cache, metrics, refresh, services
+from weatherapp.models import Race, RefreshJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Fetch and store weather for every race, or the races matching the filters. "
+        "With --checkpoint, finished races are recorded so an interrupted run can be resumed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--race', action='append', default=[], metavar='SLUG', help="Only this race (repeatable)")
+        parser.add_argument('--location', action='append', type=int, default=[], metavar='ID', help="Only races at this location id (repeatable)")
+        parser.add_argument('--kind', choices=RefreshJob.Kind.values, default=RefreshJob.Kind.HISTORIC, help="Historic weather or forecast")
+        parser.add_argument('--start-year', type=int, default=None, help=f"First year of history (defaults to {services.HISTORY_START_YEAR})")
+        parser.add_argument('--end-year', type=int, default=None, help="Last year of history (defaults to each race's year)")
+        parser.add_argument('--workers', type=int, default=None, help="Concurrent fetches (defaults to REFRESH_MAX_WORKERS)")
+        parser.add_argument('--rate-limit', type=float, default=None, help="Most fetches started per second (defaults to REFRESH_RATE_LIMIT)")
+        parser.add_argument('--force', action='store_true', help="Refetch history already stored in full")
+        parser.add_argument('--dry-run', action='store_true', help="List the requests that would be made and exit")
+        parser.add_argument('--checkpoint', metavar='PATH', help="JSON file of finished race ids; races already in it are skipped")
+        parser.add_argument(
+            '--metrics-file', default=settings.WEATHER_METRICS_TEXTFILE, metavar='PATH',
+            help="Write ingestion metrics here as races finish, for the node_exporter textfile collector"
+        )
+
+    def handle(self, *args, **options):
+        races = Race.objects.select_related('location').order_by('location_id', 'date')
+        if options['race']:
+            races = races.filter(slug__in=options['race'])
+        if options['location']:
+            races = races.filter(location_id__in=options['location'])
+
+        finished = self.load_checkpoint(options['checkpoint'])
+        races = [race for race in races if race.pk not in finished]
+        if finished:
+            self.stdout.write(f"Resuming: {len(finished)} race(s) already done")
+
+        if options['dry_run']:
+            self.dry_run(races, options)
+            return
+
+        kind = options['kind']
+        start_year, end_year = options['start_year'], options['end_year']
+        if kind == RefreshJob.Kind.HISTORIC:
+            # Every race at a location is planned together, so shared days are fetched once
+            def fetch(location_races):
+                return services.get_save_location_history(location_races, start_year, end_year, force=options['force'])
+            run = refresh.refresh_locations
+        else:
+            fetch = services.get_save_forecast
+            run = refresh.refresh_races
+
+        self.stdout.write(f"Backfilling {kind} weather for {len(races)} race(s)")
+        progress = Progress(len(races))
+        lock = threading.Lock()
+        failed = []
+        metrics_file = options['metrics_file'] if metrics.enabled() else None
+
+        def on_done(race, result, error):
+            with lock:
+                # Races fetched together share one result, which is only added to the totals once
+                progress.update(result, race.location_id if run is refresh.refresh_locations else (race.location_id, race.date.date()))
+                if metrics_file:
+                    metrics.write_textfile(metrics_file)
+                if error:
+                    failed.append(race)
+                    self.stdout.write(self.style.ERROR(f"{progress} {race}: {error}"))
+                    return
+
+                finished.add(race.pk)
+                self.save_checkpoint(options['checkpoint'], finished)
+                self.stdout.write(f"{progress} {race}: {result[0]} inserted, {result[1]} updated, {progress.rates()}")
+
+        run(races, fetch, max_workers=options['workers'], rate_limit=options['rate_limit'], on_done=on_done)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {progress.inserted} inserted, {progress.updated} updated in {progress.elapsed():.1f}s, {progress.rates()}"
+        ))
+        if failed:
+            raise CommandError(f"{len(failed)} race(s) failed: {', '.join(race.slug for race in failed)}")
+
+    def dry_run(self, races, options):
+        by_location = defaultdict(list)
+        for race in races:
+            by_location[race.location].append(race)
+
+        requests = 0
+        for location, location_races in by_location.items():
+            if options['kind'] == RefreshJob.Kind.FORECAST:
+                race_days = {race.date.date() for race in location_races}
+                spans = [(day, day) for day in sorted(race_days) if services.in_forecast_window(day)]
+            else:
+                dates = set()
+                for race in location_races:
+                    dates.update(services.historic_dates(race, options['start_year'], options['end_year']))
+                spans = [(start, end) for start, end, _ in services.plan_date_spans(sorted(dates), settings.HISTORIC_MAX_SPAN_DAYS)]
+
+            requests += len(spans)
+            names = ', '.join(race.name for race in location_races)
+            self.stdout.write(f"{location} ({names}): {', '.join(f'{start} to {end}' for start, end in spans) or 'nothing to fetch'}")
+        self.stdout.write(f"{len(races)} race(s) at {len(by_location)} location(s), up to {requests} request(s)")
+
+    def load_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return set(json.load(f)['finished'])
+
+    def save_checkpoint(self, path, finished):
+        if not path:
+            return
+        # Written whole and swapped in, so an interrupted run never leaves a truncated file
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({'finished': sorted(finished)}, f)
+        os.replace(f"{path}.tmp", path)
+
+
+class Progress:
+    """Running totals for the backfill, with rows and upstream requests per second"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.inserted = 0
+        self.updated = 0
+        self.counted = set()
+        self.started = time.monotonic()
+        self.requests_before = self.upstream_requests()
+
+    @staticmethod
+    def upstream_requests():
+        # Cache misses are the requests that actually went to Open-Meteo
+        counts = cache.stats.snapshot()
+        return counts.get('historic.miss', 0) + counts.get('forecast.miss', 0)
+
+    def update(self, result, key):
+        self.done += 1
+        if result and key not in self.counted:
+            self.counted.add(key)
+            self.inserted += result[0]
+            self.updated += result[1]
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def rates(self):
+        elapsed = max(self.elapsed(), 1e-6)
+        requests = self.upstream_requests() - self.requests_before
+        return f"{(self.inserted + self.updated) / elapsed:.0f} rows/s, {requests / elapsed:.1f} requests/s"
+
+    def __str__(self):
+        return f"[{self.done}/{self.total}]"
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from weatherapp import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the race page, the index, climatology forecasts, ingestion writes and Weather to "
+        "NumPy conversion on the data from seed_weather. With --baseline, fails if any makes "
+        "more queries or, unless --queries-only, got slower"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per benchmark; the median is reported")
+        parser.add_argument('--baseline', metavar='PATH', help="JSON results to compare against")
+        parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown against the baseline, as a fraction")
+        parser.add_argument('--queries-only', action='store_true', help="Only compare query counts, e.g. on shared CI runners whose timings are too noisy")
+        parser.add_argument('--save-baseline', metavar='PATH', help="Write these results as the new baseline")
+
+    def handle(self, *args, **options):
+        try:
+            results = benchmarks.run(repeat=options['repeat'])
+        except ValueError as e:
+            raise CommandError(e)
+
+        for name, result in results.items():
+            self.stdout.write(f"{name:24} {result['seconds'] * 1000:9.1f}ms  (best {result['best'] * 1000:.1f}ms)  {result['queries']} queries")
+
+        if options['save_baseline']:
+            benchmarks.save_baseline(options['save_baseline'], results)
+            self.stdout.write(f"Saved baseline to {options['save_baseline']}")
+
+        if options['baseline']:
+            regressions = benchmarks.compare(
+                results, benchmarks.load_baseline(options['baseline']), options['tolerance'],
+                timings=not options['queries_only']
+            )
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
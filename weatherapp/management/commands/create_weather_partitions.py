@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from weatherapp import partitions, services
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the yearly Weather partitions from HISTORY_START_YEAR, or the oldest year in the "
+        "default partition if earlier, up to WEATHER_PARTITION_YEARS_AHEAD years from now, moving "
+        "their rows out of the default partition. Postgres only; run it from cron"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-year', type=int, default=None, help="First year to cover (defaults to the oldest history, see above)")
+        parser.add_argument('--years-ahead', type=int, default=None, help="Years past this one to cover (defaults to WEATHER_PARTITION_YEARS_AHEAD)")
+
+    def handle(self, *args, **options):
+        if not partitions.is_partitioned():
+            self.stdout.write("Weather isn't partitioned on this database (Postgres only), nothing to do")
+            return
+
+        this_year = timezone.now().year
+        from_year = options['from_year']
+        if from_year is None:
+            # History backfilled before its partitions existed sits in the default partition
+            from_year = min(partitions.oldest_default_year() or services.HISTORY_START_YEAR, services.HISTORY_START_YEAR)
+        years_ahead = options['years_ahead'] if options['years_ahead'] is not None else settings.WEATHER_PARTITION_YEARS_AHEAD
+        created = partitions.ensure_partitions(from_year, this_year + years_ahead)
+
+        for year, moved in created.items():
+            self.stdout.write(f"Created {partitions.partition_name(year)}, moved {moved} row(s) out of the default partition")
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partition(s) created, years with partitions: {partitions.partition_years()}"))
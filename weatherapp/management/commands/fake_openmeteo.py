@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from weatherapp import fake_openmeteo
+from weatherapp.models import Location
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the Open-Meteo weather and geocoding APIs, with synthetic "
+        "weather and the stored locations as geocoding results. Point the OPENMETEO_*_URL "
+        "settings at it to run ingestion offline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--latency', type=float, default=0, help="Seconds added to every response")
+        parser.add_argument('--jitter', type=float, default=0, help="Random +/- seconds on top of --latency")
+        parser.add_argument('--error-rate', type=float, default=0, help="Fraction of requests answered with a 500")
+        parser.add_argument('--throttle-rate', type=float, default=0, help="Fraction of requests answered with a 429")
+        parser.add_argument('--retry-after', type=int, default=1, help="Retry-After seconds sent with 429s")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for the weather and injected failures")
+        parser.add_argument('--verbose', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        server = fake_openmeteo.FakeOpenMeteoServer(
+            (options['host'], options['port']),
+            places=fake_openmeteo.places_from_locations(Location.objects.all()),
+            latency=options['latency'], jitter=options['jitter'],
+            error_rate=options['error_rate'], throttle_rate=options['throttle_rate'],
+            retry_after=options['retry_after'], seed=options['seed'], verbose=options['verbose']
+        )
+
+        self.stdout.write(f"Serving fake Open-Meteo on {server.base_url} with {len(server.places)} place(s). Settings:")
+        for name, url in server.urls().items():
+            self.stdout.write(f'{name} = "{url}"')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Responses by status: {server.responses}")
@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from weatherapp import jobs, metrics
+
+
+class Command(BaseCommand):
+    help = "Run queued weather refresh jobs. Polls for new jobs until stopped unless --once is given"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty")
+        parser.add_argument('--batch-size', type=int, default=20, help="Jobs claimed per batch")
+        parser.add_argument('--workers', type=int, default=None, help="Concurrent fetches (defaults to REFRESH_MAX_WORKERS)")
+        parser.add_argument('--poll-interval', type=float, default=5, help="Seconds to wait when the queue is empty")
+        parser.add_argument(
+            '--metrics-file', default=settings.WEATHER_METRICS_TEXTFILE, metavar='PATH',
+            help="Write ingestion metrics here after each batch, for the node_exporter textfile collector"
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Waiting for weather jobs")
+
+        while True:
+            batch = jobs.run_pending(options['batch_size'], max_workers=options['workers'])
+
+            for job in batch:
+                if job.error:
+                    self.stdout.write(self.style.ERROR(f"{job}: {job.error}"))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{job}: {job.rows_inserted} inserted, {job.rows_updated} updated in {job.duration()}"
+                    ))
+
+            if batch and options['metrics_file'] and metrics.enabled():
+                metrics.write_textfile(options['metrics_file'])
+
+            if not batch:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from weatherapp import services
+from weatherapp.models import Location
+
+
+class Command(BaseCommand):
+    help = "Recompute the Climatology table from stored Weather, for all locations or the given location ids"
+
+    def add_arguments(self, parser):
+        parser.add_argument('location_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        locations = Location.objects.all()
+        if options['location_ids']:
+            locations = locations.filter(pk__in=options['location_ids'])
+
+        for location in locations:
+            count = services.refresh_climatology(location)
+            self.stdout.write(f"{location}: {count} climatology hour(s)")
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from weatherapp import services
+
+
+class Command(BaseCommand):
+    help = (
+        "Summarize past forecast and averaged Weather rows into DailyWeather and delete them, once "
+        "they are older than WEATHER_FORECAST_RETENTION_DAYS"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Keep this many days instead of WEATHER_FORECAST_RETENTION_DAYS")
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days']) if options['days'] is not None else None
+        days, deleted = services.rollup_forecasts(before)
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {days} day(s), deleted {deleted} hourly row(s)"))
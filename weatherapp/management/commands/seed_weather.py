@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from weatherapp import benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed synthetic benchmark locations, each with a race and hourly weather for the last "
+        "--years full years. They are kept apart from real locations and removed with --clear"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--locations', type=int, default=500, help="Locations to create")
+        parser.add_argument('--years', type=int, default=10, help="Years of hourly weather per location")
+        parser.add_argument('--races', type=int, default=1, help="Races per location")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for repeatable data")
+        parser.add_argument('--batch-size', type=int, default=10000, help="Weather rows per insert")
+        parser.add_argument('--clear', action='store_true', help="Delete the benchmark data instead")
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            deleted, per_model = benchmarks.clear()
+            self.stdout.write(f"Deleted {deleted} row(s): {per_model}")
+            return
+
+        locations = benchmarks.seed(
+            locations=options['locations'], years=options['years'], races_per_location=options['races'],
+            seed=options['seed'], batch_size=options['batch_size'], stdout=self.stdout
+        )
+        self.stdout.write(self.style.SUCCESS(f"Seeded {len(locations)} location(s)"))
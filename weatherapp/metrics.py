@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import nullcontext
+
+from django.conf import settings
+
+from . import cache
+
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the stage duration histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_null_timer = nullcontext()
+
+
+class Registry:
+    """
+    Thread-safe counters and duration histograms, keyed by metric name and label values.
+    Kept per process; each web or worker process exports its own.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            histogram[0][bisect_left(BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), {key: ([*counts], total) for key, (counts, total) in self.histograms.items()}
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+registry = Registry()
+
+
+def enabled():
+    return settings.WEATHER_METRICS_ENABLED
+
+
+class Timer:
+    """Times one stage into weatherapp_stage_seconds and counts its failures"""
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        registry.observe('weatherapp_stage_seconds', seconds, stage=self.stage, **self.labels)
+        if exc_type is not None:
+            registry.inc('weatherapp_stage_errors_total', stage=self.stage, **self.labels)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps({
+                'stage': self.stage,
+                'seconds': round(seconds, 6),
+                'error': exc_type.__name__ if exc_type else None,
+                **self.labels,
+            }, default=str))
+        return False
+
+
+def timer(stage, **labels):
+    """
+    Context manager timing a stage, e.g. `with metrics.timer('forecast.save'):`. Each stage is
+    also logged as a JSON line on the weatherapp.metrics logger at INFO.
+    A shared no-op when WEATHER_METRICS_ENABLED is off.
+    """
+    if not enabled():
+        return _null_timer
+    return Timer(stage, labels)
+
+
+def inc(name, amount=1, **labels):
+    """Add to a counter, e.g. inc('weatherapp_rows_total', 24, kind='historic', op='inserted')"""
+    if enabled():
+        registry.inc(name, amount, **labels)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    counters, histograms = registry.snapshot()
+
+    # The response cache keeps its own hit/miss counts
+    for name, count in cache.stats.snapshot().items():
+        endpoint, result = name.rsplit('.', 1)
+        counters[('weatherapp_cache_requests_total', (('endpoint', endpoint), ('result', result)))] = count
+
+    lines = []
+    for metric in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {metric} counter')
+        for (name, labels), value in sorted(counters.items()):
+            if name == metric:
+                lines.append(f'{name}{format_labels(labels)} {value:g}')
+
+    for metric in sorted({name for name, _ in histograms}):
+        lines.append(f'# TYPE {metric} histogram')
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            if name != metric:
+                continue
+            cumulative = 0
+            for bound, count in zip([*BUCKETS, '+Inf'], counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path):
+    """
+    Write render() to path for the node_exporter textfile collector. The file is written
+    whole and swapped in, so the collector never reads it half-written.
+    """
+    with open(f"{path}.tmp", 'w') as f:
+        f.write(render())
+    os.replace(f"{path}.tmp", path)
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0003_race_slug'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RefreshJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('historic', 'Historic weather'), ('forecast', 'Forecast')], max_length=10)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('race', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='weatherapp.race')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='weatherapp__status_ee3c41_idx')],
+            },
+        ),
+    ]
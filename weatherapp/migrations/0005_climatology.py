@@ -0,0 +1,42 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0004_refreshjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Climatology',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.PositiveSmallIntegerField()),
+                ('day', models.PositiveSmallIntegerField()),
+                ('hour', models.PositiveSmallIntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('humidity', models.FloatField(blank=True, null=True)),
+                ('temp', models.FloatField(blank=True, null=True)),
+                ('temp_p10', models.FloatField(blank=True, null=True)),
+                ('temp_p90', models.FloatField(blank=True, null=True)),
+                ('rain', models.FloatField(blank=True, null=True)),
+                ('precip_prob', models.FloatField(blank=True, null=True)),
+                ('precip', models.FloatField(blank=True, null=True)),
+                ('showers', models.FloatField(blank=True, null=True)),
+                ('snowfall', models.FloatField(blank=True, null=True)),
+                ('wind_speed', models.FloatField(blank=True, null=True)),
+                ('wind_direction', models.FloatField(blank=True, null=True)),
+                ('wind_gusts', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='weatherapp.location')),
+            ],
+            options={
+                'verbose_name_plural': 'climatology',
+                'unique_together': {('location', 'month', 'day', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0005_climatology'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='weather_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0006_location_weather_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='weather_updated_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0007_location_weather_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='race',
+            name='forecast_fetched_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
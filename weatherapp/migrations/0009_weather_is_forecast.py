@@ -0,0 +1,26 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:32
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def mark_future_rows_as_forecast(apps, schema_editor):
+    # Hours that haven't happened yet can only be forecasts or averages
+    Weather = apps.get_model('weatherapp', 'Weather')
+    Weather.objects.filter(datetime__gte=timezone.now()).update(is_forecast=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0008_race_forecast_fetched_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='weather',
+            name='is_forecast',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_future_rows_as_forecast, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0009_weather_is_forecast'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='location',
+            name='long',
+            field=models.DecimalField(decimal_places=5, max_digits=8),
+        ),
+        migrations.CreateModel(
+            name='Geocode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('city', models.CharField(max_length=50)),
+                ('state', models.CharField(max_length=50)),
+                ('country', models.CharField(max_length=100)),
+                ('lat', models.DecimalField(blank=True, decimal_places=5, max_digits=7, null=True)),
+                ('long', models.DecimalField(blank=True, decimal_places=5, max_digits=8, null=True)),
+                ('resolved_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('city', 'state', 'country')},
+            },
+        ),
+    ]
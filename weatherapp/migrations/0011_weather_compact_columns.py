@@ -0,0 +1,62 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:38
+
+import weatherapp.models
+from django.db import migrations, models
+
+
+MEASUREMENTS = ['rain', 'precip_prob', 'precip', 'showers', 'snowfall', 'wind_speed', 'wind_direction', 'wind_gusts']
+
+DECIMAL_FIELDS = {
+    'humidity': models.IntegerField(blank=True, null=True),
+    'temp': models.DecimalField(blank=True, decimal_places=1, max_digits=4, null=True),
+    **{name: models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True) for name in MEASUREMENTS},
+}
+
+COMPACT_FIELDS = {
+    'humidity': models.SmallIntegerField(blank=True, null=True),
+    'temp': weatherapp.models.RealField(blank=True, decimal_places=1, null=True),
+    **{name: weatherapp.models.RealField(blank=True, decimal_places=2, null=True) for name in MEASUREMENTS},
+}
+
+
+def postgres_alter_columns(fields):
+    def convert(apps, schema_editor):
+        connection = schema_editor.connection
+        if connection.vendor != 'postgresql':
+            return
+
+        # One ALTER TABLE converts every column, so the table is rewritten once rather than once per column
+        columns = []
+        for name, field in fields.items():
+            db_type = field.db_type(connection)
+            columns.append(f'ALTER COLUMN "{name}" TYPE {db_type} USING "{name}"::{db_type}')
+        schema_editor.execute(f'ALTER TABLE "weatherapp_weather" {", ".join(columns)}')
+
+    return convert
+
+
+class AlterFieldUnlessPostgres(migrations.AlterField):
+    """AlterField whose schema change is left to postgres_alter_columns on Postgres"""
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor != 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0010_geocode'),
+    ]
+
+    operations = [
+        migrations.RunPython(postgres_alter_columns(COMPACT_FIELDS), postgres_alter_columns(DECIMAL_FIELDS)),
+        *[
+            AlterFieldUnlessPostgres(model_name='weather', name=name, field=field)
+            for name, field in COMPACT_FIELDS.items()
+        ],
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:51
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0011_weather_compact_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='race',
+            index=models.Index(fields=['date', 'id'], name='race_date_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='race',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='race_upper_name_idx'),
+        ),
+    ]
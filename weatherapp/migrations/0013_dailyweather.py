@@ -0,0 +1,38 @@
+# Generated by Django 5.2.2 on 2026-10-18 13:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0012_race_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWeather',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('hours', models.PositiveSmallIntegerField(default=0)),
+                ('temp', models.FloatField(blank=True, null=True)),
+                ('temp_min', models.FloatField(blank=True, null=True)),
+                ('temp_max', models.FloatField(blank=True, null=True)),
+                ('humidity', models.FloatField(blank=True, null=True)),
+                ('precip_prob', models.FloatField(blank=True, null=True)),
+                ('precip', models.FloatField(blank=True, null=True)),
+                ('rain', models.FloatField(blank=True, null=True)),
+                ('showers', models.FloatField(blank=True, null=True)),
+                ('snowfall', models.FloatField(blank=True, null=True)),
+                ('wind_speed', models.FloatField(blank=True, null=True)),
+                ('wind_gusts', models.FloatField(blank=True, null=True)),
+                ('location', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='weatherapp.location')),
+            ],
+            options={
+                'verbose_name_plural': 'daily weather',
+                'unique_together': {('location', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Partitions weatherapp_weather by year on Postgres. Other backends keep the plain table
+
+from django.db import migrations
+from django.utils import timezone
+
+
+# services.HISTORY_START_YEAR when this was written: race pages read history from here on, so
+# those years get partitions even while empty
+HISTORY_START_YEAR = 2022
+
+
+def partition_weather(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT EXTRACT(YEAR FROM MIN(datetime) AT TIME ZONE 'UTC')::int FROM weatherapp_weather")
+        oldest = cursor.fetchone()[0]
+    first_year = min(oldest or HISTORY_START_YEAR, HISTORY_START_YEAR)
+    last_year = timezone.now().year + 1
+
+    # The primary key of a partitioned table has to include the partition key, so it becomes
+    # (id, datetime). Identity columns aren't allowed on partitioned tables before Postgres 17,
+    # so ids come from a plain sequence
+    execute = schema_editor.execute
+    execute("ALTER TABLE weatherapp_weather RENAME TO weatherapp_weather_unpartitioned")
+    # Frees the name for the new table's sequence
+    execute("ALTER SEQUENCE weatherapp_weather_id_seq RENAME TO weatherapp_weather_unpartitioned_id_seq")
+    execute("CREATE TABLE weatherapp_weather (LIKE weatherapp_weather_unpartitioned) PARTITION BY RANGE (datetime)")
+    execute("ALTER TABLE weatherapp_weather ADD CONSTRAINT weatherapp_weather_id_datetime_pk PRIMARY KEY (id, datetime)")
+    execute("ALTER TABLE weatherapp_weather ADD CONSTRAINT weatherapp_weather_location_datetime_uniq UNIQUE (location_id, datetime)")
+
+    for year in range(first_year, last_year + 1):
+        execute(
+            f"CREATE TABLE weatherapp_weather_y{year} PARTITION OF weatherapp_weather "
+            f"FOR VALUES FROM ('{year}-01-01 00:00:00+00') TO ('{year + 1}-01-01 00:00:00+00')"
+        )
+    # Rows outside the yearly partitions land here until create_weather_partitions covers them
+    execute("CREATE TABLE weatherapp_weather_default PARTITION OF weatherapp_weather DEFAULT")
+
+    # All DDL on the new table goes before the copy: the copied rows would leave deferred
+    # foreign key checks pending, and Postgres refuses to ALTER a table with pending trigger events
+    execute("CREATE SEQUENCE weatherapp_weather_id_seq OWNED BY weatherapp_weather.id")
+    execute("ALTER TABLE weatherapp_weather ALTER COLUMN id SET DEFAULT nextval('weatherapp_weather_id_seq')")
+
+    execute("INSERT INTO weatherapp_weather SELECT * FROM weatherapp_weather_unpartitioned")
+    execute("DROP TABLE weatherapp_weather_unpartitioned")
+    execute("SELECT setval('weatherapp_weather_id_seq', COALESCE((SELECT MAX(id) FROM weatherapp_weather), 0) + 1, false)")
+
+    # Added last, so the existing rows are checked once here rather than as deferred triggers
+    execute(
+        "ALTER TABLE weatherapp_weather ADD CONSTRAINT weatherapp_weather_location_id_fk "
+        "FOREIGN KEY (location_id) REFERENCES weatherapp_location (id) DEFERRABLE INITIALLY DEFERRED"
+    )
+
+
+def unpartition_weather(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    # A plain table with the constraints and identity Django would create for the model
+    execute = schema_editor.execute
+    execute("ALTER TABLE weatherapp_weather RENAME TO weatherapp_weather_partitioned")
+    execute("ALTER SEQUENCE weatherapp_weather_id_seq RENAME TO weatherapp_weather_partitioned_id_seq")
+    Weather = apps.get_model('weatherapp', 'Weather')
+    schema_editor.create_model(Weather)
+
+    columns = ', '.join(f'"{field.column}"' for field in Weather._meta.local_concrete_fields)
+    execute(f"INSERT INTO weatherapp_weather ({columns}) SELECT {columns} FROM weatherapp_weather_partitioned")
+    execute("DROP TABLE weatherapp_weather_partitioned")
+    execute(
+        "SELECT setval(pg_get_serial_sequence('weatherapp_weather', 'id'), "
+        "COALESCE((SELECT MAX(id) FROM weatherapp_weather), 0) + 1, false)"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0013_dailyweather'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_weather, unpartition_weather),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.2 on 2026-10-18 14:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weatherapp', '0014_partition_weather'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='race',
+            name='forecast_refresh_claimed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -1,15 +1,43 @@
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.text import slugify 
 from django.utils import timezone
 
 # Create your models here.
 
+class RealField(models.FloatField):
+    """
+    Single-precision float column ("real" on Postgres, 4 bytes against 8+ for numeric). Values are
+    read back rounded to decimal_places, so float32 noise like 55.29999923 comes out as 55.3.
+    """
+
+    def __init__(self, *args, decimal_places=2, **kwargs):
+        self.decimal_places = decimal_places
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['decimal_places'] = self.decimal_places
+        return name, path, args, kwargs
+
+    def db_type(self, connection):
+        if connection.vendor == 'postgresql':
+            return 'real'
+        return super().db_type(connection)
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else round(value, self.decimal_places)
+
+
 class Location(models.Model):
     city = models.CharField(max_length=50)
     state = models.CharField(max_length=50)
     country = models.CharField(max_length=100)
     lat = models.DecimalField(max_digits=7, decimal_places=5)
-    long = models.DecimalField(max_digits=7, decimal_places=5)
+    long = models.DecimalField(max_digits=8, decimal_places=5)
+    # bumped whenever this location's Weather or Climatology rows change, to invalidate cached pages
+    weather_version = models.PositiveIntegerField(default=0, editable=False)
+    weather_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         name = self.city + ", " + self.state
@@ -21,6 +49,18 @@ class Race(models.Model):
     date = models.DateTimeField("race date")
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     slug = models.SlugField(unique=True, default='slug')
+    # when a real forecast was last fetched for the race day, to know when it has gone stale
+    forecast_fetched_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # when a forecast refresh was claimed, so one runs at a time; cleared once it finishes
+    forecast_refresh_claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # keyset pagination of the race index, by date then id
+            models.Index(fields=['date', 'id'], name='race_date_id_idx'),
+            # name prefix search, as a range over the upper-cased name
+            models.Index(Upper('name'), name='race_upper_name_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         self.slug = slugify(self.name)
@@ -34,16 +74,18 @@ class Race(models.Model):
 class Weather(models.Model):
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
     datetime = models.DateTimeField()
-    humidity = models.IntegerField(null=True, blank=True)
-    temp = models.DecimalField(max_digits=4, decimal_places=1, null=True, blank=True)
-    rain = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    precip_prob = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    precip = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    showers = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    snowfall = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    wind_speed = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    wind_direction = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
-    wind_gusts = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    humidity = models.SmallIntegerField(null=True, blank=True)
+    temp = RealField(decimal_places=1, null=True, blank=True)
+    rain = RealField(null=True, blank=True)
+    precip_prob = RealField(null=True, blank=True)
+    precip = RealField(null=True, blank=True)
+    showers = RealField(null=True, blank=True)
+    snowfall = RealField(null=True, blank=True)
+    wind_speed = RealField(null=True, blank=True)
+    wind_direction = RealField(null=True, blank=True)
+    wind_gusts = RealField(null=True, blank=True)
+    # forecast or averaged rows, replaced by observed history once the day is past
+    is_forecast = models.BooleanField(default=False)
 
     class Meta:
         unique_together = ('location', 'datetime')
@@ -52,4 +94,108 @@ class Weather(models.Model):
         local_dt = timezone.localtime(self.datetime)
         return f"{self.location.city}, {self.location.state} - {local_dt.strftime('%y/%m/%d %H:%M')}"  
 
-    
\ No newline at end of file
+    
+# typical weather for one location, calendar day and hour (UTC), across all past years
+class Climatology(models.Model):
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    month = models.PositiveSmallIntegerField()
+    day = models.PositiveSmallIntegerField()
+    hour = models.PositiveSmallIntegerField()
+    count = models.IntegerField(default=0)
+    humidity = models.FloatField(null=True, blank=True)
+    temp = models.FloatField(null=True, blank=True)
+    temp_p10 = models.FloatField(null=True, blank=True)
+    temp_p90 = models.FloatField(null=True, blank=True)
+    rain = models.FloatField(null=True, blank=True)
+    precip_prob = models.FloatField(null=True, blank=True)
+    precip = models.FloatField(null=True, blank=True)
+    showers = models.FloatField(null=True, blank=True)
+    snowfall = models.FloatField(null=True, blank=True)
+    wind_speed = models.FloatField(null=True, blank=True)
+    wind_direction = models.FloatField(null=True, blank=True)
+    wind_gusts = models.FloatField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('location', 'month', 'day', 'hour')
+        verbose_name_plural = 'climatology'
+
+    def __str__(self):
+        return f"{self.location.city}, {self.location.state} - {self.month:02d}/{self.day:02d} {self.hour:02d}:00 UTC"
+
+
+# one day of forecast or averaged weather for a location, kept once its hourly rows are
+# past WEATHER_FORECAST_RETENTION_DAYS and dropped from Weather
+class DailyWeather(models.Model):
+    location = models.ForeignKey(Location, on_delete=models.CASCADE)
+    date = models.DateField()
+    hours = models.PositiveSmallIntegerField(default=0)
+    temp = models.FloatField(null=True, blank=True)
+    temp_min = models.FloatField(null=True, blank=True)
+    temp_max = models.FloatField(null=True, blank=True)
+    humidity = models.FloatField(null=True, blank=True)
+    precip_prob = models.FloatField(null=True, blank=True)
+    precip = models.FloatField(null=True, blank=True)
+    rain = models.FloatField(null=True, blank=True)
+    showers = models.FloatField(null=True, blank=True)
+    snowfall = models.FloatField(null=True, blank=True)
+    wind_speed = models.FloatField(null=True, blank=True)
+    wind_gusts = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('location', 'date')
+        verbose_name_plural = 'daily weather'
+
+    def __str__(self):
+        return f"{self.location.city}, {self.location.state} - {self.date}"
+
+
+# a resolved geocoding lookup, so each place name only goes to the API once. lat/long are empty for names with no match
+class Geocode(models.Model):
+    city = models.CharField(max_length=50)
+    state = models.CharField(max_length=50)
+    country = models.CharField(max_length=100)
+    lat = models.DecimalField(max_digits=7, decimal_places=5, null=True, blank=True)
+    long = models.DecimalField(max_digits=8, decimal_places=5, null=True, blank=True)
+    resolved_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('city', 'state', 'country')
+
+    def __str__(self):
+        return f"{self.city}, {self.state}, {self.country}"
+
+
+# a queued weather refresh for one race, run by the process_weather_jobs worker
+class RefreshJob(models.Model):
+
+    class Kind(models.TextChoices):
+        HISTORIC = 'historic', 'Historic weather'
+        FORECAST = 'forecast', 'Forecast'
+
+    class Status(models.TextChoices):
+        QUEUED = 'queued', 'Queued'
+        RUNNING = 'running', 'Running'
+        DONE = 'done', 'Done'
+        FAILED = 'failed', 'Failed'
+
+    race = models.ForeignKey(Race, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.QUEUED)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    rows_inserted = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def duration(self):
+        if self.started_at and self.finished_at:
+            return self.finished_at - self.started_at
+        return None
+
+    def __str__(self):
+        return f"{self.get_kind_display()} for {self.race} ({self.get_status_display()})"
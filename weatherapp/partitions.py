@@ -0,0 +1,80 @@
+"""
+Yearly partitions of the Weather table on Postgres (see migration 0014). Race pages and the
+climatology read whole-day UTC ranges, so Postgres prunes their scans to the partitions of the
+years asked for.
+"""
+from django.db import connection, transaction
+
+
+TABLE = 'weatherapp_weather'
+DEFAULT_PARTITION = f'{TABLE}_default'
+
+
+def is_partitioned():
+    """Whether the Weather table is partitioned, i.e. this is Postgres and migration 0014 has run"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [TABLE])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partition_name(year):
+    return f'{TABLE}_y{year}'
+
+
+def partition_years():
+    """Years that have their own partition"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = %s",
+            [TABLE]
+        )
+        names = [name for name, in cursor.fetchall()]
+    prefix = partition_name('')
+    return sorted(int(name[len(prefix):]) for name in names if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def oldest_default_year():
+    """UTC year of the oldest row in the default partition, or None if it is empty"""
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT EXTRACT(YEAR FROM MIN(datetime) AT TIME ZONE 'UTC')::int FROM {DEFAULT_PARTITION}")
+        return cursor.fetchone()[0]
+
+
+def create_partition(year):
+    """
+    Add the partition for a year. Rows of that year already in the default partition are moved
+    into it first, as Postgres won't attach a partition while the default holds rows for it.
+    """
+    name = connection.ops.quote_name(partition_name(year))
+    start, end = f'{year}-01-01 00:00:00+00', f'{year + 1}-01-01 00:00:00+00'
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE datetime >= '{start}' AND datetime < '{end}' RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        )
+        moved = cursor.rowcount
+        # Partition bounds are literals; DDL takes no parameters
+        cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')")
+
+    return moved
+
+
+def ensure_partitions(first_year, last_year):
+    """
+    Create the missing partitions for first_year to last_year.
+    Returns {year: rows moved out of the default partition} for each created one.
+    """
+    existing = set(partition_years())
+    return {
+        year: create_partition(year)
+        for year in range(first_year, last_year + 1)
+        if year not in existing
+    }
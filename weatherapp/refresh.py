@@ -0,0 +1,135 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+
+_lock = threading.Lock()
+_background = None
+
+
+class RateLimiter:
+    """Spaces calls out so no more than `rate` start per second, across all threads"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_time = 0
+
+    def wait(self):
+        if not self.interval:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+def refresh_races(races, fetch, max_workers=None, rate_limit=None, on_done=None):
+    """
+    Run fetch(race), e.g. services.get_save_historic_weather, for many races concurrently.
+
+    Races sharing a Location are handled by one worker, one after another, so they never
+    write the same Weather rows at once, and races at the same location and date are only
+    fetched once. Returns a list of (race, result, error) in the order the races were given.
+    If given, on_done(race, result, error) is called from the worker as each race finishes.
+    """
+    def refresh_location(location_races, limiter, results):
+        done = {}
+        for race in location_races:
+            key = race.date.date()
+            if key not in done:
+                limiter.wait()
+                try:
+                    done[key] = (fetch(race), None)
+                except Exception as e:
+                    done[key] = (None, e)
+            results[race.pk] = done[key]
+            if on_done:
+                on_done(race, *done[key])
+
+    return run_per_location(races, refresh_location, max_workers, rate_limit)
+
+
+def refresh_locations(races, fetch, max_workers=None, rate_limit=None, on_done=None):
+    """
+    Like refresh_races, but fetch(location_races), e.g. services.get_save_location_history, is
+    called once per Location with all of its races, so their date needs are merged into one
+    plan. Every race at the location gets the location's result.
+    """
+    def refresh_location(location_races, limiter, results):
+        limiter.wait()
+        try:
+            outcome = (fetch(location_races), None)
+        except Exception as e:
+            outcome = (None, e)
+        for race in location_races:
+            results[race.pk] = outcome
+            if on_done:
+                on_done(race, *outcome)
+
+    return run_per_location(races, refresh_location, max_workers, rate_limit)
+
+
+def run_per_location(races, work, max_workers=None, rate_limit=None):
+    """Group races by Location and run work(location_races, limiter, results) for each group in a thread pool"""
+    max_workers = max_workers or settings.REFRESH_MAX_WORKERS
+    limiter = RateLimiter(settings.REFRESH_RATE_LIMIT if rate_limit is None else rate_limit)
+
+    races = list(races)
+    by_location = defaultdict(list)
+    for race in races:
+        by_location[race.location_id].append(race)
+
+    results = {}
+
+    def run(location_races):
+        try:
+            work(location_races, limiter, results)
+        finally:
+            # Each worker thread gets its own database connection
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(run, by_location.values()))
+
+    return [(race, *results[race.pk]) for race in races]
+
+
+def background_executor():
+    """Process-wide pool for refreshes started by page views"""
+    global _background
+    if _background is None:
+        with _lock:
+            if _background is None:
+                _background = ThreadPoolExecutor(
+                    max_workers=settings.FORECAST_REFRESH_WORKERS,
+                    thread_name_prefix='weather-refresh'
+                )
+    return _background
+
+
+def refresh_in_background(key, fetch, *args, on_done=None):
+    """
+    Run fetch(*args) on the background pool; `key` names the refresh in the log. Callers take
+    their own lock first, e.g. services.claim_forecast_refresh, and give it back in on_done(),
+    which runs once the fetch finishes whether or not it raised. Returns the Future.
+    """
+    def run():
+        try:
+            return fetch(*args)
+        except Exception as e:
+            print(f"Background refresh {key} failed: {e}")
+        finally:
+            if on_done:
+                on_done()
+            connections.close_all()
+
+    return background_executor().submit(run)
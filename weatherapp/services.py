@@ -1,311 +1,680 @@
-import openmeteo_requests
-import requests_cache
 import numpy as np
-from retry_requests import retry
-from datetime import datetime, date, timedelta, timezone as dt_timezone
+from asgiref.sync import sync_to_async
+from datetime import datetime, date, time, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Max, Min, Q, Sum
+from django.db.models.functions import ExtractDay, ExtractHour, ExtractMonth, TruncDate
 from django.utils import timezone
-from collections import defaultdict
-import os
-import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+from operator import or_
+import warnings
 
-# Add the project root to the path
-ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-sys.path.append(ROOT_DIR)
+from weatherapp import clients, metrics
+from weatherapp.models import Climatology, DailyWeather, Geocode, Weather, Location, Race
 
-# Set up Django
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'weathersite.settings')
-import django
 
-from weatherapp.models import Weather, Location
+# Open-Meteo history goes back to 2022
+HISTORY_START_YEAR = 2022
 
+# Races up to this many days out get a real forecast; later ones get averages of past weather
+FORECAST_DAYS = 14
 
+# Open-Meteo hourly variables, in the order the Weather fields are read back from the response
+HOURLY_VARIABLES = ["temperature_2m", "relative_humidity_2m", "rain", "precipitation_probability", "precipitation", "showers", "snowfall", "wind_speed_10m", "wind_direction_10m", "wind_gusts_10m"]
+WEATHER_FIELDS = ["temp", "humidity", "rain", "precip_prob", "precip", "showers", "snowfall", "wind_speed", "wind_direction", "wind_gusts"]
 
-def get_coord(location):
 
-    city = location.city
-    state = location.state
-    country = location.country
+def response_to_weather(response, location, dates=None, is_forecast=False):
+    """
+    Convert the hourly block of an Open-Meteo response into unsaved Weather rows.
+    If dates is given, only hours falling on those (UTC) days are kept.
+    """
+    hourly = response.Hourly()
+
+    start_time = hourly.Time()        # start timestamp (UNIX)
+    end_time = hourly.TimeEnd()       # end timestamp (UNIX)
+    interval_seconds = hourly.Interval()
+    hours = int((end_time - start_time) / interval_seconds)
+    timestamps = start_time + np.arange(hours) * interval_seconds
+
+    # One column per variable; missing (NaN) values are stored as None
+    with metrics.timer('decode'):
+        values = np.column_stack([hourly.Variables(i).ValuesAsNumpy()[:hours] for i in range(len(WEATHER_FIELDS))]).astype(np.float64)
+
+    # Slice the wanted days out of a longer span before building any rows
+    if dates is not None:
+        wanted_days = [(d - date(1970, 1, 1)).days for d in dates]
+        keep = np.isin(timestamps // 86400, wanted_days)
+        timestamps = timestamps[keep]
+        values = values[keep]
+
+    with metrics.timer('convert'):
+        missing = np.isnan(values)
+
+        rows = []
+        for ts, row, row_missing in zip(timestamps.tolist(), values.tolist(), missing.tolist()):
+            dt = datetime.fromtimestamp(ts, tz=dt_timezone.utc)
+            weather_data = {
+                field: None if is_missing else value
+                for field, value, is_missing in zip(WEATHER_FIELDS, row, row_missing)
+            }
+            rows.append(Weather(location=location, datetime=dt, is_forecast=is_forecast, **weather_data))
+
+    return rows
+
+
+def save_weather(location, rows, kind='forecast'):
+    """
+    Upsert Weather rows for a location in a single query. kind ('forecast' or 'historic')
+    labels the timings and row counts. Returns (inserted, updated) counts.
+    """
+    if not rows:
+        return 0, 0
+
+    with metrics.timer('save', kind=kind):
+        inserted, updated = upsert_weather(location, rows)
+
+    metrics.inc('weatherapp_rows_written_total', inserted, kind=kind, op='inserted')
+    metrics.inc('weatherapp_rows_written_total', updated, kind=kind, op='updated')
+    return inserted, updated
+
+
+def upsert_weather(location, rows):
+    """save_weather without the instrumentation, for a non-empty list of rows"""
+    # Look up exactly the hours being written: a range from first to last would read every
+    # stored hour in between, which for race days years apart is years of rows
+    datetimes = {row.datetime for row in rows}
+    existing = Weather.objects.filter(
+        location=location,
+        datetime__in=datetimes
+    ).values_list('datetime', flat=True)
+    updated = len(datetimes.intersection(existing))
+
+    Weather.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['location', 'datetime'],
+        update_fields=[*WEATHER_FIELDS, 'is_forecast']
+    )
+
+    # Keep the climatology of the days that gained past hours up to date
+    now = timezone.now()
+    days = {(dt.astimezone(dt_timezone.utc).month, dt.astimezone(dt_timezone.utc).day) for dt in datetimes if dt < now}
+    if days:
+        refresh_climatology(location, days)  # also bumps the weather version
+    else:
+        bump_weather_version(location)
+
+    return len(datetimes) - updated, updated
+
+
+# Statistics weather_stats() can compute, over the NaN-free values of each field
+CLIMATOLOGY_STATS = {
+    'mean': lambda values: np.nanmean(values, axis=0),
+    'median': lambda values: np.nanmedian(values, axis=0),
+    'p10': lambda values: np.nanpercentile(values, 10, axis=0),
+    'p90': lambda values: np.nanpercentile(values, 90, axis=0),
+    'std': lambda values: np.nanstd(values, axis=0),
+}
+
+
+def weather_stats(records, key_size, stats=('mean',)):
+    """
+    Reduce values_list records of (key..., *WEATHER_FIELDS) to statistics per key, in NumPy.
+    Returns {key: {'count': n, stat: {field: value}}} where key is a tuple of the first
+    key_size columns. A field with no values for a key is None.
+    """
+    if not records:
+        return {}
+
+    # None becomes NaN so the nan-aware reductions skip missing values
+    data = np.array(records, dtype=np.float64)
+    data = data[np.lexsort(data[:, key_size - 1::-1].T)]
+    keys, starts = np.unique(data[:, :key_size], axis=0, return_index=True)
+
+    results = {}
+    with warnings.catch_warnings():
+        # An all-NaN column just means no data for that field
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for key, values in zip(keys.astype(int).tolist(), np.split(data[:, key_size:], starts[1:])):
+            key_stats = {'count': len(values)}
+            for stat in stats:
+                result = CLIMATOLOGY_STATS[stat](values)
+                key_stats[stat] = {
+                    field: None if np.isnan(value) else value
+                    for field, value in zip(WEATHER_FIELDS, result.tolist())
+                }
+            results[tuple(key)] = key_stats
+
+    return results
+
 
-    cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
-    retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-    
-    url = "https://geocoding-api.open-meteo.com/v1/search"
+def same_day_ranges(month, day, years, start_hour=0, end_hour=24):
+    """
+    Q matching the UTC calendar day month/day in each of the given years, limited to the UTC hours
+    start_hour <= hour < end_hour. Written as datetime ranges so the (location, datetime) index
+    serves it; years without the day (Feb 29) are skipped.
+    """
+    ranges = []
+    for year in years:
+        try:
+            day_start = datetime(year, month, day, tzinfo=dt_timezone.utc)
+        except ValueError:
+            continue
+        ranges.append(Q(
+            datetime__gte=day_start + timedelta(hours=start_hour),
+            datetime__lt=day_start + timedelta(hours=end_hour)
+        ))
+
+    return reduce(or_, ranges, Q(pk__in=[]))
+
+
+def utc_parts(queryset):
+    """Annotate a Weather queryset with the UTC month, day and hour of each row"""
+    return queryset.annotate(
+        month=ExtractMonth('datetime', tzinfo=dt_timezone.utc),
+        day=ExtractDay('datetime', tzinfo=dt_timezone.utc),
+        hour=ExtractHour('datetime', tzinfo=dt_timezone.utc)
+    )
+
+
+def refresh_climatology(location, days=None, start_year=None):
+    """
+    Recompute the Climatology rows of a location from its past observed Weather since
+    start_year (default HISTORY_START_YEAR), for the given (month, day) pairs or for every
+    day when days is None. Returns the number of rows written.
+    """
+    start_year = start_year or HISTORY_START_YEAR
+
+    # Both paths average the same years, so a full rebuild and an update of a few days agree
+    history = Weather.objects.filter(
+        location=location,
+        datetime__gte=datetime(start_year, 1, 1, tzinfo=dt_timezone.utc),
+        datetime__lt=timezone.now(),
+        is_forecast=False
+    )
+    if days is not None:
+        if not days:
+            return 0
+        years = range(start_year, date.today().year + 1)
+        history = history.filter(reduce(or_, (same_day_ranges(month, day, years) for month, day in days)))
+
+    records = utc_parts(history).values_list('month', 'day', 'hour', *WEATHER_FIELDS)
+    rows = [
+        Climatology(
+            location=location, month=month, day=day, hour=hour, count=hour_stats['count'],
+            temp_p10=hour_stats['p10']['temp'], temp_p90=hour_stats['p90']['temp'],
+            **hour_stats['mean']
+        )
+        for (month, day, hour), hour_stats in weather_stats(records, 3, ('mean', 'p10', 'p90')).items()
+    ]
+
+    Climatology.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['location', 'month', 'day', 'hour'],
+        update_fields=['count', *WEATHER_FIELDS, 'temp_p10', 'temp_p90', 'updated_at']
+    )
+    bump_weather_version(location)
+
+    return len(rows)
+
+
+# How each DailyWeather field is computed from a day of hourly Weather
+DAILY_AGGREGATES = {
+    'hours': Count('id'),
+    'temp': Avg('temp'),
+    'temp_min': Min('temp'),
+    'temp_max': Max('temp'),
+    'humidity': Avg('humidity'),
+    'precip_prob': Max('precip_prob'),
+    'precip': Sum('precip'),
+    'rain': Sum('rain'),
+    'showers': Sum('showers'),
+    'snowfall': Sum('snowfall'),
+    'wind_speed': Avg('wind_speed'),
+    'wind_gusts': Max('wind_gusts'),
+}
+
+
+def rollup_forecasts(before=None):
+    """
+    Summarize the forecast and averaged Weather rows of whole UTC days before `before` (defaults
+    to WEATHER_FORECAST_RETENTION_DAYS ago) into DailyWeather, then delete them. Observed history
+    is never touched. Returns (days summarized, hourly rows deleted).
+    """
+    before = before or timezone.now() - timedelta(days=settings.WEATHER_FORECAST_RETENTION_DAYS)
+    cutoff = datetime.combine(before.astimezone(dt_timezone.utc).date(), time(0), tzinfo=dt_timezone.utc)
+    stale = Weather.objects.filter(is_forecast=True, datetime__lt=cutoff)
+
+    with transaction.atomic():
+        # Aggregates are named after, but can't share names with, the Weather fields they read
+        summaries = stale.annotate(day=TruncDate('datetime', tzinfo=dt_timezone.utc)).values('location_id', 'day').order_by().annotate(
+            **{f'daily_{field}': aggregate for field, aggregate in DAILY_AGGREGATES.items()}
+        )
+        rows = [
+            DailyWeather(
+                location_id=summary['location_id'], date=summary['day'],
+                **{field: summary[f'daily_{field}'] for field in DAILY_AGGREGATES}
+            )
+            for summary in summaries
+        ]
+        if not rows:
+            return 0, 0
+
+        DailyWeather.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['location', 'date'],
+            update_fields=list(DAILY_AGGREGATES)
+        )
+        deleted, _ = stale.delete()
+        for location_id in {row.location_id for row in rows}:
+            bump_weather_version(Location(pk=location_id))
+
+    return len(rows), deleted
+
+
+def bump_weather_version(location):
+    """Mark the location's weather as changed, so pages cached for the old version are not served"""
+    Location.objects.filter(pk=location.pk).update(
+        weather_version=F('weather_version') + 1,
+        weather_updated_at=timezone.now()
+    )
+
+
+def plan_date_spans(dates, max_span_days):
+    """
+    Group dates into as few (start_date, end_date, dates) spans as possible,
+    each no longer than max_span_days, so they can be fetched one request per span.
+    """
+    spans = []
+    for d in sorted(set(dates)):
+        if spans and (d - spans[-1][0]).days < max_span_days:
+            spans[-1][1] = d
+            spans[-1][2].add(d)
+        else:
+            spans.append([d, d, {d}])
+
+    return [tuple(span) for span in spans]
+
+
+def grid_coordinate(value):
+    """Round a latitude or longitude to the nearest OPENMETEO_GRID_DEGREES step"""
+    step = settings.OPENMETEO_GRID_DEGREES
+    return round(round(float(value) / step) * step, 5)
+
+
+def fetch_hourly(openmeteo, url, location, start_date, end_date):
+    """
+    Request hourly weather for a location over a date span. Open-Meteo returns a list
+    holding the one response. With an AsyncClient this returns an awaitable.
+    """
     params = {
-	"name": city,
-	"count": 3,
-    "format": "json"
+        # Snapped to the model grid, so nearby locations make identical requests and share cached responses
+        "latitude": grid_coordinate(location.lat),
+        "longitude": grid_coordinate(location.long),
+        "start_date": start_date,
+        "end_date": end_date,
+        "hourly": HOURLY_VARIABLES,
+        "wind_speed_unit": "mph",
+        "temperature_unit": "fahrenheit"
     }
 
-    # Use api to search for locations and coords based on city/state/country
-    response = retry_session.get(url, params=params)
-    data = response.json()
+    return openmeteo.weather_api(url, params=params)
 
-    if "results" not in data or not data["results"]:
-        raise ValueError(f"No results found for: {city}, {state}, {country}")
-    
-    # Normalize filters for matching
+
+def get_coord(location):
+    """Look up and save the coordinates of one location. Raises ValueError if the place isn't found"""
+    located, failed = geocode_locations([location])
+    if failed:
+        raise ValueError(failed[0][1])
+
+    print(f"Updated {location} with coordinates: {location.lat}, {location.long}")
+    return location.lat, location.long
+
+
+def place_key(city, state, country):
+    """Normalized (city, state, country), as matched against results and stored in the Geocode index"""
     def normalize(s):
-        return s.strip().lower() if s else None
+        return s.strip().lower() if s else ''
+
+    return normalize(city), normalize(state), normalize(country)
 
-    target_country = normalize(country)
-    target_state = normalize(state)
 
-    # Filter by country and state (admin1), if provided
-    filtered_results = []
-    for result in data["results"]:
-        result_country = normalize(result.get("country"))
-        result_state = normalize(result.get("admin1"))
+def lookup_coord(city, state, country):
+    """
+    Ask the geocoding API for a place. Returns (lat, long) of the first result in the given
+    state (admin1) and country, or None if there is no such result.
+    """
+    params = {
+        "name": city,
+        "count": 3,
+        "format": "json"
+    }
 
+    # Use api to search for locations and coords based on city/state/country
+    response = clients.get_session().get(settings.OPENMETEO_GEOCODING_URL, params=params)
+    response.raise_for_status()
+    data = response.json()
+
+    _, target_state, target_country = place_key(city, state, country)
+    for result in data.get("results") or []:
+        _, result_state, result_country = place_key('', result.get("admin1"), result.get("country"))
         if target_country and result_country != target_country:
             continue
         if target_state and result_state != target_state:
             continue
+        return result["latitude"], result["longitude"]
+
+    return None
+
+
+def geocode_locations(locations, max_workers=None):
+    """
+    Resolve the coordinates of many locations at once. Each distinct place is looked up once:
+    from the Geocode index if it was resolved before, misses included, otherwise from the API,
+    with up to GEOCODE_MAX_WORKERS lookups in flight. New answers are added to the index and the
+    locations are saved with one bulk_update.
+
+    Returns (located, failed): the updated locations and a list of (location, reason).
+    """
+    locations = [(location, place_key(location.city, location.state, location.country)) for location in locations]
+    wanted = {key for _, key in locations}
+    # The API is searched with the place as written on the first location naming it
+    names = {}
+    for location, key in locations:
+        names.setdefault(key, (location.city.strip(), location.state, location.country))
+
+    with metrics.timer('geocode.index'):
+        known = {
+            (geocode.city, geocode.state, geocode.country): geocode
+            for geocode in Geocode.objects.filter(city__in={city for city, _, _ in wanted})
+        }
+    to_lookup = sorted(wanted - set(known))
+    metrics.inc('weatherapp_geocode_lookups_total', len(wanted) - len(to_lookup), result='indexed')
 
-        filtered_results.append(result)
+    def lookup(key):
+        try:
+            with metrics.timer('geocode.request'):
+                return lookup_coord(*names[key]), None
+        except Exception as e:
+            return None, str(e)
+
+    errors = {}
+    new = []
+    if to_lookup:
+        with ThreadPoolExecutor(max_workers=max_workers or settings.GEOCODE_MAX_WORKERS) as executor:
+            for key, (coord, error) in zip(to_lookup, executor.map(lookup, to_lookup)):
+                # Failed requests are not remembered, so they are retried next time
+                if error:
+                    errors[key] = error
+                    metrics.inc('weatherapp_geocode_lookups_total', result='error')
+                    continue
+                metrics.inc('weatherapp_geocode_lookups_total', result='found' if coord else 'not_found')
+                lat, long = coord or (None, None)
+                known[key] = Geocode(city=key[0], state=key[1], country=key[2], lat=lat, long=long)
+                new.append(known[key])
+        with metrics.timer('geocode.save'):
+            Geocode.objects.bulk_create(new, ignore_conflicts=True)
+
+    located, failed = [], []
+    for location, key in locations:
+        geocode = known.get(key)
+        if geocode is None:
+            failed.append((location, errors[key]))
+        elif geocode.lat is None:
+            failed.append((location, f"No results found for city='{location.city}' with state='{location.state}' and country='{location.country}'"))
+        else:
+            location.lat, location.long = geocode.lat, geocode.long
+            located.append(location)
+
+    with metrics.timer('geocode.save'):
+        Location.objects.bulk_update(located, ['lat', 'long'])
+    print(f"Geocoded {len(located)} location(s) with {len(to_lookup)} lookup(s), {len(failed)} not found")
+    return located, failed
+
+
+def in_forecast_window(race_date):
+    today = date.today()
+    return today < race_date <= today + timedelta(days=FORECAST_DAYS)
 
-    if not filtered_results:
-        raise ValueError(f"No results found for city='{city}' with state='{state}' and country='{country}'")
 
-    best_match = filtered_results[0]  # implement ranking logic 
+def forecast_is_stale(race):
+    """Whether an upcoming race's forecast was never fetched or is older than FORECAST_STALE_AFTER"""
+    if not in_forecast_window(race.date.date()):
+        return False
+    fetched_at = race.forecast_fetched_at
+    return fetched_at is None or timezone.now() - fetched_at > timedelta(seconds=settings.FORECAST_STALE_AFTER)
 
-    print(best_match["latitude"], best_match["longitude"])
 
-    location.lat = best_match["latitude"]
-    location.long = best_match["longitude"] 
-    location.save()  
-    print(f"Updated {location} with coordinates: {location.lat}, {location.long}")
+def claim_forecast_refresh(race):
+    """
+    Take the race's forecast refresh, so one process or thread fetches it at a time. The claim
+    is a conditional update setting forecast_refresh_claimed_at to now, which only one caller
+    wins, and only while no other refresh holds it: there is no claim, or it was taken over
+    REFRESH_LOCK_TIMEOUT seconds ago by a worker that died. Returns the claim time, or None.
+    """
+    now = timezone.now()
+    claimed = Race.objects.filter(
+        Q(forecast_refresh_claimed_at__isnull=True)
+        | Q(forecast_refresh_claimed_at__lt=now - timedelta(seconds=settings.REFRESH_LOCK_TIMEOUT)),
+        pk=race.pk
+    ).update(forecast_refresh_claimed_at=now)
+    return now if claimed else None
 
-    return best_match["latitude"], best_match["longitude"]
-    
 
-def get_save_forecast(race):
-    lat = race.location.lat
-    long = race.location.long
+def release_forecast_refresh(race, claimed_at):
+    """Give back a claim once its refresh has finished or failed, unless it already lapsed to another"""
+    Race.objects.filter(pk=race.pk, forecast_refresh_claimed_at=claimed_at).update(forecast_refresh_claimed_at=None)
+
+
+def mark_forecast_fetched(race):
+    race.forecast_fetched_at = timezone.now()
+    Race.objects.filter(pk=race.pk).update(forecast_fetched_at=race.forecast_fetched_at)
 
+
+def get_save_forecast(race):
     today = date.today()
     race_date = race.date.date()
-    within_next_14_days = today < race_date <= today + timedelta(days=14)
+    within_next_14_days = in_forecast_window(race_date)
+
+    # Past races have real weather from get_save_historic_weather; don't overwrite it with averages
+    if race_date <= today:
+        print(f"Race on {race_date} has already happened, no forecast needed")
+        return 0, 0
 
     # Call the API to fetch weather if the race happnes within the next 14 days. Otherwise, generate weather data as an average of past weather
     if within_next_14_days:
-        cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
-        retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-        openmeteo = openmeteo_requests.Client(session = retry_session)
-        url = "https://api.open-meteo.com/v1/forecast"
-
-        params = {
-                "latitude": lat,
-                "longitude": long,
-                "start_date": race_date,
-                "end_date": race_date,
-                "hourly": ["relative_humidity_2m", "temperature_2m", "rain", "precipitation_probability", "precipitation", "showers", "snowfall", "wind_speed_10m", "wind_direction_10m", "wind_gusts_10m"],
-                "wind_speed_unit": "mph",
-                "temperature_unit": "fahrenheit"
-                }
-        responses = openmeteo.weather_api(url, params=params)
-        response = responses[0]
-        hourly = response.Hourly()
-                
-        start_time = hourly.Time()        # start timestamp (UNIX)
-        end_time = hourly.TimeEnd()       # end timestamp (UNIX)
-        interval_seconds = hourly.Interval()  
-
-        # Generate list of timestamps
-        times = [
-            datetime.fromtimestamp(start_time + i * interval_seconds, tz=dt_timezone.utc)
-            for i in range(int((end_time - start_time) / interval_seconds))
-        ]
+        openmeteo = clients.get_client()
 
-        # Get all variable values
-        var_data = {
-            "temp": hourly.Variables(0).ValuesAsNumpy(),
-            "humidity": hourly.Variables(1).ValuesAsNumpy(),
-            "rain": hourly.Variables(2).ValuesAsNumpy(),
-            "precip_prob": hourly.Variables(3).ValuesAsNumpy(),
-            "precip": hourly.Variables(4).ValuesAsNumpy(),
-            "showers": hourly.Variables(5).ValuesAsNumpy(),
-            "snowfall": hourly.Variables(6).ValuesAsNumpy(),
-            "wind_speed": hourly.Variables(7).ValuesAsNumpy(),
-            "wind_direction": hourly.Variables(8).ValuesAsNumpy(),
-            "wind_gusts": hourly.Variables(9).ValuesAsNumpy()
-        }
-        
-        
-        print(f"Processing {len(times)} hours for {race_date}")
-        
-        location = race.location
-        for i, dt in enumerate(times):
-            weather_data = {
-                field: float(var_data[field][i]) if not np.isnan(var_data[field][i]) else None
-                for field in var_data
-            }
+        try:
+            with metrics.timer('fetch', kind='forecast'):
+                responses = fetch_hourly(openmeteo, settings.OPENMETEO_FORECAST_URL, race.location, race_date, race_date)
+        except Exception:
+            metrics.inc('weatherapp_fetch_errors_total', kind='forecast', year=race_date.year)
+            raise
+        rows = response_to_weather(responses[0], race.location, is_forecast=True)
 
-            Weather.objects.update_or_create(
-                location=location,
-                datetime=dt,
-                defaults=weather_data
-            )
+        print(f"Processing {len(rows)} hours for {race_date}")
+
+        inserted, updated = save_weather(race.location, rows)
+        mark_forecast_fetched(race)
 
     # Generate forecast from historic weather
     else:
-        historic_weather = Weather.objects.filter(
+        # Averages for this calendar day from the precomputed climatology (UTC hours)
+        climatology = Climatology.objects.filter(
             location=race.location,
-            datetime__month=race_date.month,
-            datetime__day=race_date.day
-            ).exclude(
-                datetime__year=race_date.year
-            ).order_by('datetime')
-        
-        # Group historic weather by hour
-        hourly_data = defaultdict(list)
-
-    #    for w in historic_weather:
-    #        print(f'Hour: {w.datetime.hour}')
-    #        print(f'Temp: {w.temp}')
-        
-        for weather in historic_weather:
-            hour = weather.datetime.hour
-            hourly_data[hour].append(weather)
-        
-        for hour in range(24):  # 0-23 hours
-            if hour in hourly_data:
-                historic_for_hour = hourly_data[hour]
-                
-                # Helper function to calculate average
-                def safe_avg(field_name):
-                    values = [getattr(w, field_name) for w in historic_for_hour if getattr(w, field_name) is not None]
-                    return sum(values) / len(values) if values else None
-                
-                # Calculate averages for this hour
-                avg_temp = safe_avg('temp')
-                avg_humidity = safe_avg('humidity')
-                avg_rain = safe_avg('rain')
-                avg_precip_prob = safe_avg('precip_prob')
-                avg_precip = safe_avg('precip')
-                avg_showers = safe_avg('showers')
-                avg_snowfall = safe_avg('snowfall')
-                avg_wind_speed = safe_avg('wind_speed')
-                avg_wind_direction = safe_avg('wind_direction')
-                avg_wind_gusts = safe_avg('wind_gusts')
-                
-                # Create forecast datetime for this hour
-                forecast_datetime = timezone.make_aware(
-                    datetime.combine(race_date, datetime.min.time().replace(hour=hour))
-                )
-                
-                # Save the forecast weather to database
-                Weather.objects.update_or_create(
-                    location=race.location,
-                    datetime=forecast_datetime,
-                    defaults={
-                        'temp': avg_temp,
-                        'humidity': avg_humidity,
-                        'rain': avg_rain,
-                        'precip_prob': avg_precip_prob,
-                        'precip': avg_precip,
-                        'showers': avg_showers,
-                        'snowfall': avg_snowfall,
-                        'wind_speed': avg_wind_speed,
-                        'wind_direction': avg_wind_direction,
-                        'wind_gusts': avg_wind_gusts,
-                    }
-                )
+            month=race_date.month,
+            day=race_date.day
+        ).order_by('hour')
+
+        rows = []
+        for hour_stats in climatology:
+            # Create forecast datetime for this hour
+            forecast_datetime = datetime.combine(race_date, time(hour_stats.hour), tzinfo=dt_timezone.utc)
+
+            rows.append(Weather(
+                location=race.location,
+                datetime=forecast_datetime,
+                is_forecast=True,
+                **{field: getattr(hour_stats, field) for field in WEATHER_FIELDS}
+            ))
+
+        # Save the forecast weather to database
+        inserted, updated = save_weather(race.location, rows)
         
         print(f"Generated forecast from historic data for {race_date}")
-    
 
-    
+    print(f"Saved forecast for {race_date}: {inserted} inserted, {updated} updated")
+    return inserted, updated
 
-def get_save_historic_weather(race):
 
-    lat = race.location.lat
-    long = race.location.long
+async def aget_save_forecast(race):
+    """
+    get_save_forecast for async views. The Open-Meteo call is awaited on the AsyncClient so a slow
+    upstream holds no worker thread; only the database writes run in a thread.
+    """
     race_date = race.date.date()
-    start_year = 2022 # API history goes back to 2022
-    end_year = race.date.year
-
-    local_tz = timezone.get_current_timezone()
-
-    # Setup the Open-Meteo API client with cache and retry on error
-    cache_session = requests_cache.CachedSession('.cache', expire_after = 3600)
-    retry_session = retry(cache_session, retries = 5, backoff_factor = 0.2)
-    openmeteo = openmeteo_requests.Client(session = retry_session)
-    url = "https://historical-forecast-api.open-meteo.com/v1/forecast"
-
-    for year in range(start_year, end_year + 1):
+    if not in_forecast_window(race_date):
+        # Past races and climatology forecasts don't touch the network
+        return await sync_to_async(get_save_forecast)(race)
+
+    try:
+        with metrics.timer('fetch', kind='forecast'):
+            responses = await fetch_hourly(clients.get_async_client(), settings.OPENMETEO_FORECAST_URL, race.location, race_date, race_date)
+    except Exception:
+        metrics.inc('weatherapp_fetch_errors_total', kind='forecast', year=race_date.year)
+        raise
+    rows = response_to_weather(responses[0], race.location, is_forecast=True)
+
+    inserted, updated = await sync_to_async(save_weather)(race.location, rows)
+    await sync_to_async(mark_forecast_fetched)(race)
+    print(f"Saved forecast for {race_date}: {inserted} inserted, {updated} updated")
+    return inserted, updated
+
+
+def historic_dates(race, start_year=None, end_year=None):
+    """
+    The race day in every year from start_year to end_year (defaults: HISTORY_START_YEAR and the
+    race's year) that history can exist for, i.e. up to today.
+    """
+    race_date = race.date.date()
+    dates = []
+    for year in range(start_year or HISTORY_START_YEAR, (end_year or race.date.year) + 1):
         try:
             current_date = race_date.replace(year=year)
+        except ValueError:
+            print(f"No {race_date.strftime('%b %d')} in {year}, skipping")
+            continue
+        if current_date <= date.today():
+            dates.append(current_date)
+    return dates
+
+
+def stored_history(location, dates):
+    """
+    Observed (non-forecast) hours already stored for the location on the given days, read with
+    a single range query. Returns a set of UTC datetimes.
+    """
+    if not dates:
+        return set()
+    years_by_day = defaultdict(list)
+    for d in dates:
+        years_by_day[(d.month, d.day)].append(d.year)
+    return set(Weather.objects.filter(
+        reduce(or_, (same_day_ranges(month, day, years) for (month, day), years in years_by_day.items())),
+        location=location,
+        is_forecast=False
+    ).values_list('datetime', flat=True))
+
+
+def get_save_historic_weather(race, start_year=None, end_year=None, force=False):
+
+    start_year = start_year or HISTORY_START_YEAR
+    end_year = end_year or race.date.year
+
+    # Race day in every year we want history for. History only exists up to today
+    dates = historic_dates(race, start_year, end_year)
+
+    inserted, updated = save_location_history(race.location, dates, force)
+    print(f"Completed weather fetching from {start_year} to {end_year}: {inserted} inserted, {updated} updated")
+
+    return inserted, updated
+
+
+def get_save_location_history(races, start_year=None, end_year=None, force=False):
+    """
+    get_save_historic_weather for several races at one location. Their race days are merged
+    into one date set, so days they share, or that fall in the same span, are fetched once.
+    """
+    locations = {race.location_id for race in races}
+    if len(locations) != 1:
+        raise ValueError(f"Races must share one location, got {len(locations)}")
+
+    dates = set()
+    for race in races:
+        dates.update(historic_dates(race, start_year, end_year))
+
+    inserted, updated = save_location_history(races[0].location, sorted(dates), force)
+    print(f"Completed weather fetching for {len(races)} race(s) at {races[0].location}: {inserted} inserted, {updated} updated")
+
+    return inserted, updated
+
+
+def save_location_history(location, dates, force=False):
+    """
+    Fetch and store observed hourly weather for a location on the given days, in as few
+    requests as HISTORIC_MAX_SPAN_DAYS allows. Returns (inserted, updated) counts.
+    Every span is tried; if any failed, RuntimeError is raised after the rest are stored.
+    """
+    # Past history doesn't change once final: days already stored in full are skipped and only
+    # missing hours are written. Recent days may still be revised, so they are always refetched
+    final_before = date.today() - timedelta(days=settings.OPENMETEO_HISTORY_FINAL_DAYS)
+    with metrics.timer('stored', kind='historic'):
+        stored = set() if force else stored_history(location, dates)
+    stored_per_day = Counter(dt.astimezone(dt_timezone.utc).date() for dt in stored)
+    complete = {d for d in dates if d < final_before and stored_per_day[d] >= 24}
+    if complete:
+        print(f"Skipping {len(complete)} day(s) already stored: {', '.join(str(d) for d in sorted(complete))}")
+    dates = [d for d in dates if d not in complete]
+
+    # Shared Open-Meteo client with cache and retry on error
+    openmeteo = clients.get_client()
+    url = settings.OPENMETEO_HISTORIC_URL
+
+    inserted = updated = 0
+    failed = []
+    for start_date, end_date, span_dates in plan_date_spans(dates, settings.HISTORIC_MAX_SPAN_DAYS):
+        try:
+            print(f"Fetching weather for {len(span_dates)} day(s) from {start_date} to {end_date}")
 
-            print(f"Fetching weather for {current_date}")
-
-            params = {
-            "latitude": lat,
-            "longitude": long,
-            "start_date": current_date,
-            "end_date": current_date,
-            "hourly": ["temperature_2m", "relative_humidity_2m", "rain", "precipitation_probability", "precipitation", "showers", "snowfall", "wind_speed_10m", "wind_direction_10m", "wind_gusts_10m"],
-            "wind_speed_unit": "mph",
-            "temperature_unit": "fahrenheit"
-            }
-
-            responses = openmeteo.weather_api(url, params=params)
-
-            response = responses[0]
-            
-            hourly = response.Hourly()
-            
-            start_time = hourly.Time()        # start timestamp (UNIX)
-            end_time = hourly.TimeEnd()       # end timestamp (UNIX)
-            interval_seconds = hourly.Interval()  
-
-            # Generate list of timestamps
-            times = [
-                datetime.fromtimestamp(start_time + i * interval_seconds, tz=dt_timezone.utc)
-                for i in range(int((end_time - start_time) / interval_seconds))
-            ]
-
-
-            # Get all variable values
-            var_data = {
-                "humidity": hourly.Variables(1).ValuesAsNumpy(),
-                "temp": hourly.Variables(0).ValuesAsNumpy(),
-                "rain": hourly.Variables(2).ValuesAsNumpy(),
-                "precip_prob": hourly.Variables(3).ValuesAsNumpy(),
-                "precip": hourly.Variables(4).ValuesAsNumpy(),
-                "showers": hourly.Variables(5).ValuesAsNumpy(),
-                "snowfall": hourly.Variables(6).ValuesAsNumpy(),
-                "wind_speed": hourly.Variables(7).ValuesAsNumpy(),
-                "wind_direction": hourly.Variables(8).ValuesAsNumpy(),
-                "wind_gusts": hourly.Variables(9).ValuesAsNumpy()
-            }
-            
-            
-
-
-        # location, _ = Location.objects.get_or_create(lat=lat, long=long)
-            print(f"Processing {len(times)} hours for {current_date}")
-            location = race.location
+            with metrics.timer('fetch', kind='historic'):
+                responses = fetch_hourly(openmeteo, url, location, start_date, end_date)
 
+            # Keep only the days we asked for out of the span
+            rows = response_to_weather(responses[0], location, dates=span_dates)
+            rows = [row for row in rows if row.datetime not in stored or row.datetime.date() >= final_before]
 
-            for i, dt in enumerate(times):
-                weather_data = {
-                    field: float(var_data[field][i]) if not np.isnan(var_data[field][i]) else None
-                    for field in var_data
-                }
+            print(f"Processing {len(rows)} hours for {', '.join(str(d) for d in sorted(span_dates))}")
 
-                Weather.objects.update_or_create(
-                    location=location,
-                    datetime=dt,
-                    defaults=weather_data
-                )
+            span_inserted, span_updated = save_weather(location, rows, kind='historic')
+            inserted += span_inserted
+            updated += span_updated
 
         except Exception as e:
-            print(f"Error fetching weather for {year}: {str(e)}")
-            continue 
-    print(f"Completed weather fetching from {start_year} to {end_year}")
-    
-
-    
+            print(f"Error fetching weather for {start_date} to {end_date}: {str(e)}")
+            for year in sorted({d.year for d in span_dates}):
+                metrics.inc('weatherapp_fetch_errors_total', kind='historic', year=year)
+            failed.append(f"{start_date} to {end_date}: {e}")
 
+    if failed:
+        raise RuntimeError(
+            f"{len(failed)} span(s) failed for {location} ({inserted} inserted, {updated} updated): {'; '.join(failed)}"
+        )
 
-    #return weather?
+    return inserted, updated
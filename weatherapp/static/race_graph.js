@@ -0,0 +1,5 @@
+// Draws the forecast graph from the figure spec embedded in the race page
+document.addEventListener('DOMContentLoaded', function () {
+  var figure = JSON.parse(document.getElementById('forecast-figure').textContent);
+  Plotly.newPlot('forecast-graph', figure.data, figure.layout);
+});
@@ -1,3 +1,1396 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+import threading
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import parse_qs, urlparse
 
-# Create your tests here.
+import niquests
+import numpy as np
+import plotly
+import requests
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache as django_cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from openmeteo_requests.Client import OpenMeteoRequestsError
+from requests.adapters import HTTPAdapter
+from requests_cache import NEVER_EXPIRE
+from urllib3 import HTTPResponse
+
+from . import benchmarks, cache, clients, fake_openmeteo, jobs, metrics, partitions, refresh, services, views
+from .models import Climatology, DailyWeather, Geocode, Location, Race, RefreshJob, Weather
+
+
+class FakeVariable:
+    def __init__(self, values):
+        self.values = np.asarray(values, dtype=np.float32)
+
+    def ValuesAsNumpy(self):
+        return self.values
+
+
+class FakeHourly:
+    def __init__(self, start, columns, interval=3600):
+        self.start = start
+        self.columns = columns
+        self.interval = interval
+
+    def Time(self):
+        return self.start
+
+    def TimeEnd(self):
+        return self.start + len(self.columns[0]) * self.interval
+
+    def Interval(self):
+        return self.interval
+
+    def Variables(self, i):
+        return FakeVariable(self.columns[i])
+
+
+class FakeResponse:
+    """Stand-in for an Open-Meteo WeatherApiResponse with hourly data"""
+
+    def __init__(self, start, hours, temp=50.0):
+        self.hourly = FakeHourly(start, [
+            [temp + i % 24 for i in range(hours)] if field == 'temp' else [np.nan if field == 'snowfall' else 1.0] * hours
+            for field in services.WEATHER_FIELDS
+        ])
+
+    def Hourly(self):
+        return self.hourly
+
+
+class FakeClient:
+    """Stand-in for openmeteo_requests.Client that answers any date span and records requests"""
+
+    def __init__(self, *args, **kwargs):
+        self.requests = []
+
+    def weather_api(self, url, params):
+        self.requests.append((url, params))
+        start = datetime.combine(params['start_date'], datetime.min.time(), tzinfo=dt_timezone.utc)
+        hours = ((params['end_date'] - params['start_date']).days + 1) * 24
+        count = len(params['latitude']) if isinstance(params['latitude'], list) else 1
+        return [FakeResponse(int(start.timestamp()), hours) for _ in range(count)]
+
+
+class FakeAsyncClient(FakeClient):
+    """Stand-in for openmeteo_requests.AsyncClient"""
+
+    async def weather_api(self, url, params):
+        return super().weather_api(url, params)
+
+
+class DeferredExecutor:
+    """Executor that holds submitted work until run() is called"""
+
+    def __init__(self):
+        self.pending = []
+
+    def submit(self, fn):
+        self.pending.append(fn)
+        return fn
+
+    def run(self):
+        # The work runs on the test's connection, which must stay open
+        with mock.patch.object(refresh.connections, 'close_all'):
+            while self.pending:
+                self.pending.pop(0)()
+
+
+class FakeAdapter(HTTPAdapter):
+    """Transport adapter answering every request with an empty geocoding result"""
+
+    def __init__(self):
+        super().__init__()
+        self.sent = 0
+
+    def send(self, request, **kwargs):
+        self.sent += 1
+        raw = HTTPResponse(
+            body=io.BytesIO(b'{"results": []}'), status=200, preload_content=False,
+            headers={'Content-Type': 'application/json'}
+        )
+        return self.build_response(request, raw)
+
+
+class GeocodingAdapter(HTTPAdapter):
+    """Transport adapter answering geocoding searches from a dict of name -> results"""
+
+    def __init__(self, places):
+        super().__init__()
+        self.places = places
+        self.names = []
+
+    def send(self, request, **kwargs):
+        name = parse_qs(urlparse(request.url).query)['name'][0]
+        self.names.append(name)
+        if name == 'Timeout':
+            raise requests.ConnectionError('timed out')
+        raw = HTTPResponse(
+            body=io.BytesIO(json.dumps({'results': self.places.get(name, [])}).encode()), status=200,
+            preload_content=False, headers={'Content-Type': 'application/json'}
+        )
+        return self.build_response(request, raw)
+
+
+def make_location(**kwargs):
+    defaults = {'city': 'Boston', 'state': 'Massachusetts', 'country': 'United States', 'lat': 42.35843, 'long': -71.05977}
+    defaults.update(kwargs)
+    return Location.objects.create(**defaults)
+
+
+class IngestionTests(TestCase):
+
+    def setUp(self):
+        self.location = make_location()
+        self.start = int(datetime(2024, 4, 15, tzinfo=dt_timezone.utc).timestamp())
+
+    def test_response_to_weather(self):
+        rows = services.response_to_weather(FakeResponse(self.start, 24), self.location)
+
+        self.assertEqual(len(rows), 24)
+        self.assertEqual(rows[0].datetime, datetime(2024, 4, 15, tzinfo=dt_timezone.utc))
+        self.assertEqual(rows[23].datetime, datetime(2024, 4, 15, 23, tzinfo=dt_timezone.utc))
+        self.assertEqual(rows[3].temp, 53.0)
+        self.assertIsNone(rows[3].snowfall)
+
+    def test_save_weather_counts_inserts_and_updates(self):
+        rows = services.response_to_weather(FakeResponse(self.start, 24), self.location)
+        # Existing-hours lookup, upsert, climatology read and upsert, version bump
+        with self.assertNumQueries(5):
+            self.assertEqual(services.save_weather(self.location, rows), (24, 0))
+
+        # Overlapping window: 12 hours already stored, 12 new
+        rows = services.response_to_weather(FakeResponse(self.start + 12 * 3600, 24, temp=70.0), self.location)
+        self.assertEqual(services.save_weather(self.location, rows), (12, 12))
+
+        self.assertEqual(Weather.objects.filter(location=self.location).count(), 36)
+        noon = Weather.objects.get(location=self.location, datetime=datetime(2024, 4, 15, 12, tzinfo=dt_timezone.utc))
+        self.assertEqual(noon.temp, 70)
+
+        # Climatology follows the ingested rows
+        climatology = Climatology.objects.get(location=self.location, month=4, day=15, hour=12)
+        self.assertEqual(climatology.count, 1)
+        self.assertEqual(climatology.temp, 70.0)
+        self.assertEqual(Climatology.objects.filter(location=self.location).count(), 36)
+
+    def test_measurements_read_back_as_rounded_floats(self):
+        # float32 values as they come out of the Open-Meteo response
+        rows = [Weather(
+            location=self.location, datetime=datetime(2024, 4, 15, tzinfo=dt_timezone.utc),
+            temp=float(np.float32(55.3)), humidity=64.0, wind_speed=float(np.float32(12.34)), snowfall=None
+        )]
+        services.save_weather(self.location, rows)
+
+        self.assertEqual(
+            Weather.objects.values_list('temp', 'humidity', 'wind_speed', 'snowfall').get(),
+            (55.3, 64, 12.34, None)
+        )
+
+
+class HistoricFetchTests(TestCase):
+
+    def setUp(self):
+        self.location = make_location()
+        self.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime(2025, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+
+    def test_plan_date_spans(self):
+        dates = [date(2022, 4, 21), date(2023, 4, 21), date(2024, 4, 21), date(2025, 4, 21)]
+
+        spans = services.plan_date_spans(dates, max_span_days=800)
+        self.assertEqual(spans, [
+            (date(2022, 4, 21), date(2024, 4, 21), set(dates[:3])),
+            (date(2025, 4, 21), date(2025, 4, 21), {dates[3]}),
+        ])
+        self.assertEqual(len(services.plan_date_spans(dates, max_span_days=1500)), 1)
+
+    def test_response_to_weather_slices_dates(self):
+        start = int(datetime(2024, 4, 20, tzinfo=dt_timezone.utc).timestamp())
+        rows = services.response_to_weather(FakeResponse(start, 72), self.location, dates={date(2024, 4, 21)})
+
+        self.assertEqual(len(rows), 24)
+        self.assertTrue(all(row.datetime.date() == date(2024, 4, 21) for row in rows))
+        self.assertEqual(rows[0].datetime, datetime(2024, 4, 21, tzinfo=dt_timezone.utc))
+
+    def test_historic_race_day_fetched_per_year(self):
+        client = FakeClient()
+        with mock.patch.object(services.clients, 'get_client', return_value=client):
+            inserted, updated = services.get_save_historic_weather(self.race)
+
+        # Only the race day of each year is downloaded, not the years between them
+        self.assertEqual(
+            [(params['start_date'], params['end_date']) for _, params in client.requests],
+            [(date(year, 4, 21), date(year, 4, 21)) for year in range(2022, 2026)]
+        )
+        self.assertEqual((inserted, updated), (96, 0))
+        self.assertEqual(
+            sorted({dt.date() for dt in Weather.objects.values_list('datetime', flat=True)}),
+            [date(year, 4, 21) for year in range(2022, 2026)]
+        )
+
+    def test_incremental_refetch_skips_stored_days(self):
+        client = FakeClient()
+        with mock.patch.object(services.clients, 'get_client', return_value=client):
+            services.get_save_historic_weather(self.race)
+
+            # Everything is stored and final, so nothing is requested
+            self.assertEqual(services.get_save_historic_weather(self.race), (0, 0))
+            self.assertEqual(len(client.requests), 4)
+
+            # Only the day with missing hours is requested, and only those hours are written
+            Weather.objects.filter(datetime__gte=datetime(2023, 4, 21, 20, tzinfo=dt_timezone.utc), datetime__lt=datetime(2023, 4, 22, tzinfo=dt_timezone.utc)).delete()
+            self.assertEqual(services.get_save_historic_weather(self.race), (4, 0))
+            self.assertEqual(client.requests[-1][1]['start_date'], date(2023, 4, 21))
+            self.assertEqual(client.requests[-1][1]['end_date'], date(2023, 4, 21))
+
+            # Forecast rows don't count as history and are replaced
+            Weather.objects.filter(datetime__year=2022).update(is_forecast=True)
+            self.assertEqual(services.get_save_historic_weather(self.race), (0, 24))
+            self.assertFalse(Weather.objects.filter(is_forecast=True).exists())
+
+            self.assertEqual(services.get_save_historic_weather(self.race, force=True), (0, 96))
+        self.assertEqual(len(client.requests), 10)
+
+    def test_location_history_merges_race_days(self):
+        half = Race.objects.create(
+            name='Boston Half', length='13.1', location=self.location,
+            date=datetime(2025, 4, 20, 14, tzinfo=dt_timezone.utc)
+        )
+        client = FakeClient()
+        with mock.patch.object(services.clients, 'get_client', return_value=client):
+            self.assertEqual(services.get_save_location_history([self.race, half]), (192, 0))
+
+        # Both races' days of a year, in one request per year
+        self.assertEqual(
+            [(params['start_date'], params['end_date']) for _, params in client.requests],
+            [(date(year, 4, 20), date(year, 4, 21)) for year in range(2022, 2026)]
+        )
+
+        other = Race.objects.create(name='Chicago Marathon', length='26.2', location=make_location(city='Chicago'), date=self.race.date)
+        with self.assertRaises(ValueError):
+            services.get_save_location_history([self.race, other])
+
+    @override_settings(OPENMETEO_GRID_DEGREES=0.025)
+    def test_nearby_locations_request_the_same_grid_point(self):
+        nearby = make_location(city='Cambridge', lat=42.36, long=-71.06)
+        client = FakeClient()
+        services.fetch_hourly(client, settings.OPENMETEO_FORECAST_URL, self.location, date(2025, 4, 21), date(2025, 4, 21))
+        services.fetch_hourly(client, settings.OPENMETEO_FORECAST_URL, nearby, date(2025, 4, 21), date(2025, 4, 21))
+
+        self.assertEqual(client.requests[0][1], client.requests[1][1])
+        self.assertEqual((client.requests[0][1]['latitude'], client.requests[0][1]['longitude']), (42.35, -71.05))
+
+
+class RefreshRacesTests(TestCase):
+
+    def setUp(self):
+        boston = make_location()
+        chicago = make_location(city='Chicago', state='Illinois', lat=41.85003, long=-87.65005)
+        race_day = datetime(2025, 4, 21, 14, tzinfo=dt_timezone.utc)
+        self.races = [
+            Race.objects.create(name='Boston Marathon', length='26.2', location=boston, date=race_day),
+            Race.objects.create(name='Boston Half', length='13.1', location=boston, date=race_day),
+            Race.objects.create(name='Boston 10K', length='6.2', location=boston, date=race_day + timedelta(days=180)),
+            Race.objects.create(name='Chicago Marathon', length='26.2', location=chicago, date=race_day),
+        ]
+
+    def test_refresh_races_dedupes_and_collects_results(self):
+        fetched = []
+
+        def fetch(race):
+            fetched.append(race.name)
+            if race.location.city == 'Chicago':
+                raise ValueError('upstream down')
+            return 24, 0
+
+        results = refresh.refresh_races(self.races, fetch, max_workers=4, rate_limit=0)
+
+        # The half shares location and day with the marathon, so it is not fetched again
+        self.assertCountEqual(fetched, ['Boston Marathon', 'Boston 10K', 'Chicago Marathon'])
+        self.assertEqual([race for race, _, _ in results], self.races)
+        self.assertEqual([result for _, result, _ in results], [(24, 0), (24, 0), (24, 0), None])
+        self.assertIsInstance(results[3][2], ValueError)
+
+    def test_forecast_refresh_claimed_once(self):
+        race = self.races[0]
+        claimed_at = services.claim_forecast_refresh(race)
+        self.assertIsNotNone(claimed_at)
+        # Already in flight, for this and every other process reading the same row
+        self.assertIsNone(services.claim_forecast_refresh(Race.objects.get(pk=race.pk)))
+
+        # The claim leaves the fetch time alone, so staleness still reads the last real fetch
+        self.assertIsNone(Race.objects.get(pk=race.pk).forecast_fetched_at)
+
+        # A finished or failed refresh gives the claim back
+        services.release_forecast_refresh(race, claimed_at)
+        self.assertIsNone(Race.objects.get(pk=race.pk).forecast_refresh_claimed_at)
+        claimed_at = services.claim_forecast_refresh(race)
+        self.assertIsNotNone(claimed_at)
+
+        # A claim whose worker died lapses after REFRESH_LOCK_TIMEOUT
+        with override_settings(REFRESH_LOCK_TIMEOUT=0):
+            self.assertIsNotNone(services.claim_forecast_refresh(race))
+
+    def test_background_refresh_released_on_error(self):
+        race = self.races[0]
+        executor = DeferredExecutor()
+
+        def fetch(race):
+            raise ValueError('upstream down')
+
+        with mock.patch.object(refresh, 'background_executor', return_value=executor), \
+                mock.patch.object(services, 'get_save_forecast', side_effect=fetch):
+            self.assertIsNotNone(views.refresh_forecast_in_background(race))
+            self.assertIsNone(views.refresh_forecast_in_background(Race.objects.get(pk=race.pk)))
+            executor.run()
+            self.assertIsNotNone(views.refresh_forecast_in_background(Race.objects.get(pk=race.pk)))
+
+    def test_background_refresh_released_on_success(self):
+        race = self.races[0]
+        executor = DeferredExecutor()
+
+        with mock.patch.object(refresh, 'background_executor', return_value=executor), \
+                mock.patch.object(services, 'get_save_forecast', return_value=(24, 0)):
+            self.assertIsNotNone(views.refresh_forecast_in_background(race))
+            executor.run()
+
+        self.assertIsNone(Race.objects.get(pk=race.pk).forecast_refresh_claimed_at)
+
+
+class BackfillCommandTests(TransactionTestCase):
+    # The races are fetched in worker threads, which write with their own connections
+
+    def setUp(self):
+        boston = make_location()
+        self.chicago = make_location(city='Chicago', state='Illinois', lat=41.85003, long=-87.65005)
+        race_day = datetime(2025, 4, 21, 14, tzinfo=dt_timezone.utc)
+        self.boston = Race.objects.create(name='Boston Marathon', length='26.2', location=boston, date=race_day)
+        self.chicago_race = Race.objects.create(name='Chicago Marathon', length='26.2', location=self.chicago, date=race_day)
+        self.checkpoint = tempfile.NamedTemporaryFile(suffix='.json', delete=False).name
+        os.remove(self.checkpoint)
+        self.addCleanup(lambda: os.path.exists(self.checkpoint) and os.remove(self.checkpoint))
+
+    def backfill(self, *args):
+        out = io.StringIO()
+        call_command('backfill_weather', *args, '--rate-limit', '0', stdout=out)
+        return out.getvalue()
+
+    def test_backfill_with_filters_and_resume(self):
+        fetched = []
+
+        def fetch(races, start_year, end_year, force):
+            fetched.append(([race.name for race in races], start_year, end_year))
+            return 24, 0
+
+        with mock.patch.object(services, 'get_save_location_history', side_effect=fetch):
+            out = self.backfill('--location', str(self.chicago.pk), '--start-year', '2023', '--checkpoint', self.checkpoint)
+            self.assertEqual(fetched, [(['Chicago Marathon'], 2023, None)])
+            self.assertIn('rows/s', out)
+
+            # The rerun skips Chicago, already recorded in the checkpoint
+            out = self.backfill('--checkpoint', self.checkpoint)
+            self.assertEqual(fetched[1:], [(['Boston Marathon'], None, None)])
+            self.assertIn('1 race(s) already done', out)
+
+    def test_failed_races_not_checkpointed(self):
+        class BostonDownClient(FakeClient):
+            def weather_api(self, url, params):
+                if params['latitude'] == services.grid_coordinate(42.35843):
+                    raise requests.ConnectionError('upstream down')
+                return super().weather_api(url, params)
+
+        with mock.patch.object(services.clients, 'get_client', return_value=BostonDownClient()):
+            with self.assertRaisesMessage(CommandError, '1 race(s) failed: boston-marathon'):
+                self.backfill('--checkpoint', self.checkpoint)
+
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['finished'], [self.chicago_race.pk])
+
+    def test_dry_run_fetches_nothing(self):
+        with mock.patch.object(services, 'get_save_location_history') as fetch:
+            out = self.backfill('--dry-run', '--race', 'boston-marathon')
+
+        fetch.assert_not_called()
+        self.assertIn('Boston, Massachusetts (Boston Marathon): 2022-04-21 to 2022-04-21, 2023-04-21 to 2023-04-21', out)
+        self.assertIn('1 race(s) at 1 location(s), up to 4 request(s)', out)
+
+
+class RefreshJobTests(TransactionTestCase):
+    # Jobs run in worker threads, which write with their own connections
+
+    def setUp(self):
+        location = make_location()
+        race_day = datetime(2025, 4, 21, 14, tzinfo=dt_timezone.utc)
+        self.marathon = Race.objects.create(name='Boston Marathon', length='26.2', location=location, date=race_day)
+        self.half = Race.objects.create(name='Boston Half', length='13.1', location=location, date=race_day + timedelta(days=1))
+
+    def test_enqueue_skips_races_with_pending_jobs(self):
+        self.assertEqual(len(jobs.enqueue([self.marathon], RefreshJob.Kind.HISTORIC)), 1)
+        self.assertEqual(len(jobs.enqueue([self.marathon, self.half], RefreshJob.Kind.HISTORIC)), 1)
+        self.assertEqual(len(jobs.enqueue([self.marathon], RefreshJob.Kind.FORECAST)), 1)
+        self.assertEqual(RefreshJob.objects.filter(status=RefreshJob.Status.QUEUED).count(), 3)
+
+    def test_run_pending_records_results(self):
+        jobs.enqueue([self.marathon, self.half], RefreshJob.Kind.HISTORIC)
+
+        jobs.enqueue([self.half], RefreshJob.Kind.FORECAST)
+
+        def fetch_history(races):
+            self.assertEqual(races, [self.marathon, self.half])
+            return 96, 0
+
+        def fetch_forecast(race):
+            raise ValueError('upstream down')
+
+        with mock.patch.dict(jobs.LOCATION_FETCHERS, {RefreshJob.Kind.HISTORIC: fetch_history}), \
+                mock.patch.dict(jobs.FETCHERS, {RefreshJob.Kind.FORECAST: fetch_forecast}):
+            self.assertEqual(len(jobs.run_pending(10)), 3)
+            self.assertEqual(jobs.run_pending(10), [])
+
+        # Both races' history came from one fetch for their location
+        self.assertEqual(
+            list(RefreshJob.objects.filter(kind=RefreshJob.Kind.HISTORIC).values_list('status', 'rows_inserted')),
+            [(RefreshJob.Status.DONE, 96)] * 2
+        )
+        done = RefreshJob.objects.get(race=self.marathon)
+        self.assertEqual(done.status, RefreshJob.Status.DONE)
+        self.assertEqual((done.rows_inserted, done.rows_updated), (96, 0))
+        self.assertIsNotNone(done.duration())
+
+        failed = RefreshJob.objects.get(race=self.half, kind=RefreshJob.Kind.FORECAST)
+        self.assertEqual(failed.status, RefreshJob.Status.FAILED)
+        self.assertEqual(failed.error, 'upstream down')
+
+    def test_failed_history_fetch_fails_job(self):
+        jobs.enqueue([self.marathon], RefreshJob.Kind.HISTORIC)
+
+        with mock.patch.object(services.clients, 'get_client', return_value=FailingClient()):
+            jobs.run_pending(10)
+
+        job = RefreshJob.objects.get()
+        self.assertEqual(job.status, RefreshJob.Status.FAILED)
+        self.assertIn('upstream down', job.error)
+
+    def test_interrupted_run_fails_claimed_jobs(self):
+        jobs.enqueue([self.marathon, self.half], RefreshJob.Kind.FORECAST)
+
+        with mock.patch.object(jobs.refresh, 'refresh_races', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                jobs.run_pending(10)
+
+        self.assertEqual(
+            list(RefreshJob.objects.values_list('status', flat=True)),
+            [RefreshJob.Status.FAILED] * 2
+        )
+        self.assertEqual(len(jobs.enqueue([self.marathon], RefreshJob.Kind.FORECAST)), 1)
+
+    def test_stuck_jobs_failed_after_timeout(self):
+        jobs.enqueue([self.marathon, self.half], RefreshJob.Kind.FORECAST)
+        jobs.claim_jobs(10)
+        RefreshJob.objects.filter(race=self.marathon).update(started_at=timezone.now() - timedelta(hours=2))
+
+        with override_settings(REFRESH_JOB_TIMEOUT=3600):
+            # The marathon's worker is gone, so its race can be queued again; the half's is still busy
+            self.assertEqual([job.race for job in jobs.enqueue([self.marathon, self.half], RefreshJob.Kind.FORECAST)], [self.marathon])
+
+        stuck = RefreshJob.objects.get(race=self.marathon, status=RefreshJob.Status.FAILED)
+        self.assertIn('Still running after 3600s', stuck.error)
+        self.assertIsNotNone(stuck.finished_at)
+
+    def test_admin_requeue_skips_running_jobs(self):
+        jobs.enqueue([self.marathon, self.half], RefreshJob.Kind.FORECAST)
+        jobs.claim_jobs(1)
+        RefreshJob.objects.filter(status=RefreshJob.Status.QUEUED).update(status=RefreshJob.Status.FAILED, error='upstream down')
+        admin = User.objects.create_superuser('admin', password='secret')
+        self.client.force_login(admin)
+
+        self.client.post('/admin/weatherapp/refreshjob/', {
+            'action': 'requeue',
+            '_selected_action': list(RefreshJob.objects.values_list('pk', flat=True)),
+        })
+
+        statuses = dict(RefreshJob.objects.values_list('status', 'error'))
+        self.assertEqual(statuses, {RefreshJob.Status.RUNNING: '', RefreshJob.Status.QUEUED: ''})
+
+    def test_worker_writes_metrics_file(self):
+        metrics.registry.reset()
+        textfile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(textfile_dir.cleanup)
+        path = os.path.join(textfile_dir.name, 'weatherapp.prom')
+        jobs.enqueue([self.marathon], RefreshJob.Kind.HISTORIC)
+
+        with mock.patch.object(services.clients, 'get_client', return_value=FakeClient()):
+            call_command('process_weather_jobs', '--once', '--metrics-file', path, stdout=io.StringIO())
+
+        with open(path) as f:
+            body = f.read().splitlines()
+        self.assertIn('weatherapp_rows_written_total{kind="historic",op="inserted"} 96', body)
+
+
+class SharedClientTests(TestCase):
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        settings_override = override_settings(OPENMETEO_CACHE_NAME=f"{cache_dir.name}/cache", OPENMETEO_POOL_SIZE=3)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        clients.reset()
+        self.addCleanup(clients.reset)
+
+    def test_session_and_client_are_shared(self):
+        session = clients.get_session()
+
+        self.assertIs(clients.get_session(), session)
+        self.assertIs(clients.get_client().session, session)
+        self.assertEqual(session.get_adapter('https://api.open-meteo.com')._pool_maxsize, 3)
+
+        clients.reset()
+        self.assertIsNot(clients.get_session(), session)
+
+
+class ResponseCacheTests(TestCase):
+
+    def setUp(self):
+        settings_override = override_settings(OPENMETEO_CACHE_BACKEND='memory', OPENMETEO_CACHE_MEMORY_SIZE=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        clients.reset()
+        self.addCleanup(clients.reset)
+        cache.stats.reset()
+
+    def test_expire_after_policy(self):
+        today = date.today()
+        forecast_url = "https://api.open-meteo.com/v1/forecast"
+        historic_url = "https://historical-forecast-api.open-meteo.com/v1/forecast"
+
+        self.assertEqual(cache.expire_after("https://geocoding-api.open-meteo.com/v1/search"), 30 * 24 * 3600)
+        self.assertEqual(cache.expire_after(forecast_url, {'end_date': today - timedelta(days=30)}), 3600)
+        self.assertEqual(cache.expire_after(historic_url, {'end_date': today - timedelta(days=30)}), NEVER_EXPIRE)
+        self.assertEqual(cache.expire_after(historic_url, {'end_date': str(today - timedelta(days=30))}), NEVER_EXPIRE)
+        self.assertEqual(cache.expire_after(historic_url, {'end_date': today - timedelta(days=1)}), 3600)
+
+    def test_memory_tier_counts_hits_and_misses(self):
+        session = clients.get_session()
+        adapter = FakeAdapter()
+        session.mount('https://', adapter)
+        url = "https://geocoding-api.open-meteo.com/v1/search"
+
+        for city in ['Boston', 'Boston', 'Chicago', 'Denver', 'Boston']:
+            response = session.get(url, params={'name': city})
+            self.assertEqual(response.json(), {'results': []})
+
+        # Boston is evicted from the 2-entry memory tier but still in the backend
+        self.assertEqual(adapter.sent, 3)
+        self.assertEqual(len(session.cache.responses.front), 2)
+        self.assertEqual(cache.stats.snapshot(), {
+            'geocoding.miss': 3, 'geocoding.hit': 2, 'memory.miss': 4, 'memory.hit': 1,
+        })
+
+
+class GeocodingTests(TestCase):
+
+    def setUp(self):
+        settings_override = override_settings(OPENMETEO_CACHE_BACKEND='memory')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        clients.reset()
+        self.addCleanup(clients.reset)
+        self.adapter = GeocodingAdapter({
+            'Boston': [
+                {'latitude': 52.97633, 'longitude': -0.02664, 'admin1': 'England', 'country': 'United Kingdom'},
+                {'latitude': 42.35843, 'longitude': -71.05977, 'admin1': 'Massachusetts', 'country': 'United States'},
+            ],
+            'San Francisco': [
+                {'latitude': 37.77493, 'longitude': -122.41942, 'admin1': 'California', 'country': 'United States'},
+            ],
+        })
+        clients.get_session().mount('https://', self.adapter)
+
+    def test_batch_geocoding_dedupes_and_remembers(self):
+        locations = [
+            make_location(lat=0, long=0),
+            make_location(city=' boston ', lat=0, long=0),
+            make_location(city='San Francisco', state='California', lat=0, long=0),
+            make_location(city='Nowhere', state='Kansas', lat=0, long=0),
+            make_location(city='Timeout', state='Kansas', lat=0, long=0),
+        ]
+
+        located, failed = services.geocode_locations(Location.objects.order_by('pk'))
+
+        self.assertEqual(sorted(self.adapter.names), ['Boston', 'Nowhere', 'San Francisco', 'Timeout'])
+        self.assertEqual([location.pk for location in located], [l.pk for l in locations[:3]])
+        self.assertEqual([location.pk for location, _ in failed], [l.pk for l in locations[3:]])
+        boston, _, san_francisco = Location.objects.order_by('pk')[:3]
+        self.assertEqual((boston.lat, boston.long), (Decimal('42.35843'), Decimal('-71.05977')))
+        self.assertEqual(san_francisco.long, Decimal('-122.41942'))
+
+        # Hits and misses come from the index; only the failed request is retried
+        clients.reset()
+        clients.get_session().mount('https://', self.adapter)
+        with self.assertNumQueries(3):
+            located, failed = services.geocode_locations(Location.objects.order_by('pk'))
+        self.assertEqual(len(located), 3)
+        self.assertEqual(len(failed), 2)
+        self.assertEqual(self.adapter.names[4:], ['Timeout'])
+        self.assertFalse(Geocode.objects.filter(city='timeout').exists())
+        self.assertTrue(Geocode.objects.filter(city='nowhere', lat__isnull=True).exists())
+
+    def test_get_coord(self):
+        location = make_location(lat=0, long=0)
+        services.get_coord(location)
+        location.refresh_from_db()
+        self.assertEqual((location.lat, location.long), (Decimal('42.35843'), Decimal('-71.05977')))
+
+        with self.assertRaises(ValueError):
+            services.get_coord(make_location(city='Nowhere', lat=0, long=0))
+
+
+class ClimatologyTests(TestCase):
+
+    def setUp(self):
+        self.location = make_location()
+        # Three past years of 14:00 and 15:00 UTC readings on April 21
+        for year, temp in [(2022, 50), (2023, 54), (2024, 61)]:
+            for hour in (14, 15):
+                Weather.objects.create(
+                    location=self.location, datetime=datetime(year, 4, 21, hour, tzinfo=dt_timezone.utc),
+                    temp=temp + hour - 14, humidity=70, snowfall=None
+                )
+
+    def test_weather_stats(self):
+        records = services.utc_parts(Weather.objects.filter(location=self.location)).values_list('hour', *services.WEATHER_FIELDS)
+        with self.assertNumQueries(1):
+            climatology = {key[0]: stats for key, stats in services.weather_stats(records, 1, ('mean', 'median', 'p90', 'std')).items()}
+
+        self.assertEqual(sorted(climatology), [14, 15])
+        self.assertEqual(climatology[14]['count'], 3)
+        self.assertAlmostEqual(climatology[14]['mean']['temp'], 55.0)
+        self.assertAlmostEqual(climatology[15]['mean']['temp'], 56.0)
+        self.assertAlmostEqual(climatology[14]['median']['temp'], 54.0)
+        self.assertAlmostEqual(climatology[14]['p90']['temp'], 59.6)
+        self.assertAlmostEqual(climatology[14]['std']['temp'], np.std([50, 54, 61]))
+        self.assertEqual(climatology[14]['mean']['humidity'], 70.0)
+        self.assertIsNone(climatology[14]['mean']['snowfall'])
+
+        self.assertEqual(services.weather_stats([], 1), {})
+
+    def test_forecast_from_history(self):
+        race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime(date.today().year + 2, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+        self.assertEqual(services.refresh_climatology(self.location), 2)
+
+        # Climatology, existing-hours lookup, upsert, version bump
+        with self.assertNumQueries(4):
+            self.assertEqual(services.get_save_forecast(race), (2, 0))
+
+        forecast = Weather.objects.filter(location=self.location, datetime__year=race.date.year).order_by('datetime')
+        self.assertEqual([float(w.temp) for w in forecast], [55.0, 56.0])
+        self.assertEqual(forecast[0].datetime, race.date)
+
+        # Future forecast rows are not history, so they don't feed back into the climatology
+        self.assertEqual(Climatology.objects.get(location=self.location, hour=14).count, 3)
+
+    def test_refresh_climatology(self):
+        self.assertEqual(services.refresh_climatology(self.location, days={(4, 21)}), 2)
+        self.assertEqual(services.refresh_climatology(self.location, days={(4, 22)}), 0)
+
+        climatology = Climatology.objects.get(location=self.location, month=4, day=21, hour=14)
+        self.assertEqual(climatology.count, 3)
+        self.assertAlmostEqual(climatology.temp, 55.0)
+        self.assertAlmostEqual(climatology.temp_p10, 50.8)
+        self.assertAlmostEqual(climatology.temp_p90, 59.6)
+        self.assertIsNone(climatology.snowfall)
+
+    def test_full_and_incremental_refresh_use_the_same_years(self):
+        # History from before HISTORY_START_YEAR is left out either way
+        Weather.objects.create(location=self.location, datetime=datetime(2019, 4, 21, 14, tzinfo=dt_timezone.utc), temp=0)
+
+        services.refresh_climatology(self.location)
+        full = Climatology.objects.get(location=self.location, month=4, day=21, hour=14)
+        services.refresh_climatology(self.location, days={(4, 21)})
+        incremental = Climatology.objects.get(location=self.location, month=4, day=21, hour=14)
+
+        self.assertEqual((full.count, full.temp), (3, 55.0))
+        self.assertEqual((incremental.count, incremental.temp), (full.count, full.temp))
+
+
+class WeatherQueryPlanTests(TestCase):
+    """The race page's Weather queries must be served by the (location, datetime) index"""
+
+    @classmethod
+    def setUpTestData(cls):
+        start = datetime(2022, 1, 1, tzinfo=dt_timezone.utc)
+        for city in ['Boston', 'Chicago']:
+            location = make_location(city=city)
+            Weather.objects.bulk_create(
+                [Weather(location=location, datetime=start + timedelta(hours=i), temp=50) for i in range(3 * 365 * 24)],
+                batch_size=5000
+            )
+        cls.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=location,
+            date=datetime(2024, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        django_cache.clear()
+
+    def populated_tables(self):
+        """The tables holding Weather rows: the partitions that have any when Weather is partitioned"""
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT DISTINCT tableoid::regclass::text FROM weatherapp_weather')
+            return [name for name, in cursor.fetchall()]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                return '\n'.join(row[-1] for row in cursor.fetchall())
+            cursor.execute(f'EXPLAIN {sql}')
+            return '\n'.join(row[0] for row in cursor.fetchall())
+
+    def test_race_page_weather_queries_use_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/weatherapp/race/{self.race.slug}')
+        self.assertEqual(response.status_code, 200)
+
+        weather_queries = [q['sql'] for q in queries if 'FROM "weatherapp_weather"' in q['sql']]
+        self.assertTrue(weather_queries)
+
+        for sql in weather_queries:
+            plan = self.explain(sql)
+            with self.subTest(sql=sql):
+                if connection.vendor == 'sqlite':
+                    # Both columns of the index, not just location_id followed by a filter over every row
+                    self.assertRegex(plan, r'USING (COVERING )?INDEX weatherapp_weather_location_id_datetime\w* \(location_id=\? AND datetime[<>=]')
+                    self.assertNotIn('SCAN weatherapp_weather', plan)
+                else:
+                    self.assertIn('Index', plan)
+                    # Empty partitions of the years with no data yet may be scanned, they hold nothing
+                    for table in self.populated_tables():
+                        self.assertNotRegex(plan, rf'Seq Scan on {table}\b')
+
+
+class RacePageTests(TestCase):
+
+    def setUp(self):
+        django_cache.clear()
+        self.location = make_location()
+        for year in (2022, 2023, 2024):
+            Weather.objects.bulk_create([
+                Weather(location=self.location, datetime=datetime(year, 4, 21, hour, tzinfo=dt_timezone.utc), temp=year - 1970 + hour, humidity=60)
+                for hour in range(24)
+            ])
+        # Neighbouring day, which must not show up
+        Weather.objects.create(location=self.location, datetime=datetime(2024, 4, 22, 14, tzinfo=dt_timezone.utc), temp=99)
+        services.refresh_climatology(self.location)
+        self.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime(2024, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+
+    def test_race_page_query_budget(self):
+        # Race with its location, the race day across years, the climatology
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertEqual(response.status_code, 200)
+        context = response.context
+        self.assertEqual(len(context['weather_forecast']), 24)
+        self.assertTrue(all(w.datetime.year == 2024 for w in context['weather_forecast']))
+        self.assertEqual(context['start_weather'].datetime, self.race.date)
+        self.assertEqual(context['start_weather'].temp, 68)
+        self.assertEqual(len(context['historic_weather']), 48)
+        self.assertEqual({w.datetime.year for w in context['historic_weather']}, {2022, 2023})
+        self.assertEqual(context['start_climatology'].count, 3)
+        self.assertEqual(len(context['climatology']), 24)
+
+    def test_race_page_without_weather(self):
+        Weather.objects.all().delete()
+        Climatology.objects.all().delete()
+
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['start_weather'])
+        self.assertIsNone(response.context['forecast_graph'])
+        self.assertContains(response, 'No weather data available for this race.')
+
+    def test_race_page_cached_until_weather_changes(self):
+        url = f'/weatherapp/race/{self.race.slug}'
+        first = self.client.get(url)
+
+        # Repeat views only load the race to read its location's weather version
+        with self.assertNumQueries(1):
+            second = self.client.get(url)
+        self.assertEqual(second.content, first.content)
+
+        rows = [Weather(location=self.location, datetime=self.race.date, temp=40, humidity=90)]
+        services.save_weather(self.location, rows)
+
+        with self.assertNumQueries(3):
+            third = self.client.get(url)
+        self.assertEqual(third.context['start_weather'].temp, 40)
+
+    def test_race_page_links_plotly_instead_of_inlining_it(self):
+        response = self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertContains(response, 'id="forecast-figure" type="application/json"')
+        self.assertContains(response, f'src="/weatherapp/js/plotly-{plotly.__version__}.min.js"')
+        self.assertNotIn(views.plotly_js_bundle()[:200], response.content.decode())
+        self.assertLess(len(response.content), 200_000)
+
+    def test_race_page_revalidates_with_etag(self):
+        url = f'/weatherapp/race/{self.race.slug}'
+        first = self.client.get(url)
+        self.assertIn('ETag', first)
+        self.assertIn('Last-Modified', first)
+
+        # A matching validator is answered from the race row alone
+        with self.assertNumQueries(1):
+            revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+        services.save_weather(self.location, [Weather(location=self.location, datetime=self.race.date, temp=40)])
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_page_revalidated_after_plotly_upgrade(self):
+        url = f'/weatherapp/race/{self.race.slug}'
+        first = self.client.get(url)
+
+        with mock.patch.object(plotly, '__version__', '99.0.0'):
+            upgraded = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(upgraded.status_code, 200)
+        self.assertIn('/weatherapp/js/plotly-99.0.0.min.js', upgraded.content.decode())
+
+    def test_plotly_js_served_with_long_lived_caching(self):
+        url = f'/weatherapp/js/plotly-{plotly.__version__}.min.js'
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # The bundle is only cached for good under its own version
+        other = '/weatherapp/js/plotly-0.0.1.min.js'
+        self.assertEqual(self.client.get(other).status_code, 404)
+        self.assertEqual(self.client.get(other, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 404)
+
+
+class RaceApiTests(TestCase):
+
+    def setUp(self):
+        self.location = make_location()
+        for year in (2022, 2023, 2024):
+            Weather.objects.bulk_create([
+                Weather(location=self.location, datetime=datetime(year, 4, 21, hour, tzinfo=dt_timezone.utc), temp=year - 1970 + hour, humidity=60)
+                for hour in range(24)
+            ])
+        services.refresh_climatology(self.location)
+        self.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime(2024, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+        self.url = f'/weatherapp/api/race/{self.race.slug}'
+
+    def test_forecast_is_columnar(self):
+        # Race with its location, then the race day's weather
+        with self.assertNumQueries(2):
+            response = self.client.get(f'{self.url}/forecast')
+
+        self.assertEqual(response.status_code, 200)
+        columns = response.json()['columns']
+        self.assertEqual(list(columns), ['datetime'] + services.WEATHER_FIELDS)
+        self.assertEqual(len(columns['datetime']), 24)
+        self.assertEqual(columns['datetime'][14], '2024-04-21T14:00:00Z')
+        self.assertEqual(columns['temp'][14], 68.0)
+        self.assertIsNone(columns['rain'][0])
+
+    def test_historic_field_selection_and_hour_window(self):
+        response = self.client.get(f'{self.url}/historic', {'fields': 'temp', 'start_hour': 12, 'end_hour': 16})
+
+        columns = response.json()['columns']
+        self.assertEqual(list(columns), ['datetime', 'temp'])
+        self.assertEqual(len(columns['datetime']), 8)
+        self.assertEqual({d[:4] for d in columns['datetime']}, {'2022', '2023'})
+        self.assertEqual(columns['temp'][:4], [64.0, 65.0, 66.0, 67.0])
+
+    def test_climatology(self):
+        response = self.client.get(f'{self.url}/climatology', {'fields': 'temp,count,temp_p90', 'start_hour': 14, 'end_hour': 15})
+
+        self.assertEqual(response.json()['columns'], {'hour': [14], 'temp': [67.0], 'count': [3], 'temp_p90': [67.8]})
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(f'{self.url}/forecast', {'fields': 'temp,pressure'}).status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}/forecast', {'start_hour': 20, 'end_hour': 10}).status_code, 400)
+        self.assertEqual(self.client.get(f'{self.url}/forecast', {'start_hour': 'noon'}).status_code, 400)
+        self.assertEqual(self.client.get('/weatherapp/api/race/unknown/forecast').status_code, 404)
+
+    def test_empty_payload_keeps_columns(self):
+        Weather.objects.all().delete()
+        columns = self.client.get(f'{self.url}/forecast', {'fields': 'temp'}).json()['columns']
+        self.assertEqual(columns, {'datetime': [], 'temp': []})
+
+
+class AsyncRacePageTests(TestCase):
+
+    def setUp(self):
+        django_cache.clear()
+        self.location = make_location()
+        race_day = date.today() + timedelta(days=3)
+        self.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime.combine(race_day, datetime.min.time().replace(hour=14), tzinfo=dt_timezone.utc)
+        )
+
+    async def test_index(self):
+        response = await self.async_client.get('/weatherapp/')
+        self.assertContains(response, 'Boston Marathon')
+
+    def test_cold_upcoming_race_fetches_forecast(self):
+        client = FakeAsyncClient()
+        with mock.patch.object(clients, 'get_async_client', return_value=client):
+            first = self.client.get(f'/weatherapp/race/{self.race.slug}')
+            second = self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(client.requests[0][0], settings.OPENMETEO_FORECAST_URL)
+        self.assertEqual(len(first.context['weather_forecast']), 24)
+        self.assertEqual(first.context['start_weather'].datetime, self.race.date)
+        self.assertEqual(second.content, first.content)
+
+        # The page is cached under the version the fetch produced
+        self.location.refresh_from_db()
+        self.assertEqual(self.location.weather_version, 1)
+        self.assertEqual(first['ETag'], views.race_validators(Race.objects.select_related('location').get(pk=self.race.pk))[0])
+
+    def test_figure_and_render_run_off_the_event_loop(self):
+        threads = []
+
+        def record(name, target):
+            def wrapper(*args, **kwargs):
+                threads.append((name, threading.current_thread()))
+                return target(*args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(clients, 'get_async_client', return_value=FakeAsyncClient()), \
+                mock.patch.object(views, 'forecast_figure', record('figure', views.forecast_figure)), \
+                mock.patch.object(views, 'render_to_string', record('render', views.render_to_string)):
+            response = self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertIsNotNone(response.context['forecast_graph'])
+        self.assertEqual([name for name, _ in threads], ['figure', 'figure', 'render'])
+        # The test client runs the view's event loop in a thread of its own; sync_to_async moves the work back
+        self.assertTrue(all(thread is threading.main_thread() for _, thread in threads))
+
+    def test_failed_fetch_still_renders(self):
+        client = mock.Mock(weather_api=mock.AsyncMock(side_effect=OSError('timed out')))
+        with mock.patch.object(clients, 'get_async_client', return_value=client):
+            response = self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['start_weather'])
+
+    async def test_async_client_per_event_loop(self):
+        client = clients.get_async_client()
+        self.assertIs(clients.get_async_client(), client)
+        self.assertIsInstance(client.session, niquests.AsyncSession)
+        clients.reset()
+        self.assertIsNot(clients.get_async_client(), client)
+
+    def test_stale_forecast_served_then_refreshed_in_background(self):
+        Weather.objects.bulk_create([
+            Weather(location=self.location, datetime=self.race.date.replace(hour=hour), temp=40, humidity=90)
+            for hour in range(24)
+        ])
+        Race.objects.filter(pk=self.race.pk).update(forecast_fetched_at=timezone.now() - timedelta(hours=2))
+        url = f'/weatherapp/race/{self.race.slug}'
+        executor = DeferredExecutor()
+        client = FakeClient()
+
+        with mock.patch.object(refresh, 'background_executor', return_value=executor), \
+                mock.patch.object(clients, 'get_client', return_value=client):
+            stale = self.client.get(url)
+            self.client.get(url)
+            # Served at once from the stored rows, with a single refresh queued for both hits
+            self.assertEqual(stale.context['start_weather'].temp, 40)
+            self.assertEqual(len(executor.pending), 1)
+            self.assertEqual(client.requests, [])
+
+            executor.run()
+            fresh = self.client.get(url)
+
+        self.assertEqual(len(client.requests), 1)
+        self.assertEqual(fresh.context['start_weather'].temp, 64)
+        self.assertNotEqual(fresh['ETag'], stale['ETag'])
+        self.assertEqual(executor.pending, [])
+
+    def test_fresh_forecast_not_refreshed(self):
+        Weather.objects.create(location=self.location, datetime=self.race.date, temp=40)
+        Race.objects.filter(pk=self.race.pk).update(forecast_fetched_at=timezone.now())
+        executor = DeferredExecutor()
+
+        with mock.patch.object(refresh, 'background_executor', return_value=executor):
+            self.client.get(f'/weatherapp/race/{self.race.slug}')
+
+        self.assertEqual(executor.pending, [])
+
+
+class FailingClient(FakeClient):
+    def weather_api(self, url, params):
+        raise requests.ConnectionError('upstream down')
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        cache.stats.reset()
+        self.location = make_location()
+        self.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime(2025, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+
+    def test_historic_fetch_stages_and_rows(self):
+        with mock.patch.object(services.clients, 'get_client', return_value=FakeClient()):
+            services.get_save_historic_weather(self.race)
+
+        counters, histograms = metrics.registry.snapshot()
+        self.assertEqual(counters[('weatherapp_rows_written_total', (('kind', 'historic'), ('op', 'inserted')))], 96)
+        stages = {dict(labels)['stage'] for name, labels in histograms}
+        self.assertTrue({'stored', 'fetch', 'decode', 'convert', 'save'} <= stages)
+
+    def test_fetch_errors_counted_by_year(self):
+        with mock.patch.object(services.clients, 'get_client', return_value=FailingClient()):
+            with self.assertRaisesMessage(RuntimeError, '4 span(s) failed'):
+                services.get_save_historic_weather(self.race)
+
+        counters, _ = metrics.registry.snapshot()
+        for year in range(2022, 2026):
+            self.assertEqual(counters[('weatherapp_fetch_errors_total', (('kind', 'historic'), ('year', year)))], 1)
+        self.assertEqual(counters[('weatherapp_stage_errors_total', (('kind', 'historic'), ('stage', 'fetch')))], 4)
+
+    def test_stages_logged_as_json(self):
+        with self.assertLogs('weatherapp.metrics', 'INFO') as logs:
+            with metrics.timer('save', kind='forecast'):
+                pass
+
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['stage'], line['kind'], line['error']), ('save', 'forecast', None))
+
+    def test_metrics_endpoint(self):
+        metrics.inc('weatherapp_rows_written_total', 24, kind='forecast', op='inserted')
+        with metrics.timer('fetch', kind='forecast'):
+            pass
+        cache.stats.record('forecast', False)
+
+        response = self.client.get('/weatherapp/metrics')
+
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = response.content.decode().splitlines()
+        self.assertIn('# TYPE weatherapp_rows_written_total counter', body)
+        self.assertIn('weatherapp_rows_written_total{kind="forecast",op="inserted"} 24', body)
+        self.assertIn('weatherapp_stage_seconds_bucket{kind="forecast",stage="fetch",le="+Inf"} 1', body)
+        self.assertIn('weatherapp_stage_seconds_count{kind="forecast",stage="fetch"} 1', body)
+        self.assertIn('weatherapp_cache_requests_total{endpoint="forecast",result="miss"} 1', body)
+
+    def test_metrics_endpoint_restricted(self):
+        self.assertEqual(self.client.get('/weatherapp/metrics', REMOTE_ADDR='203.0.113.5').status_code, 403)
+
+        staff = User.objects.create_user('ops', password='secret', is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/weatherapp/metrics', REMOTE_ADDR='203.0.113.5').status_code, 200)
+
+    @override_settings(WEATHER_METRICS_ENABLED=False)
+    def test_disabled(self):
+        with mock.patch.object(services.clients, 'get_client', return_value=FakeClient()):
+            services.get_save_historic_weather(self.race)
+
+        self.assertEqual(metrics.registry.snapshot(), ({}, {}))
+        self.assertIs(metrics.timer('save'), metrics.timer('fetch'))
+        self.assertEqual(self.client.get('/weatherapp/metrics').status_code, 404)
+
+
+class BenchmarkTests(TestCase):
+
+    def test_seed_and_compare_against_baseline(self):
+        call_command('seed_weather', locations=1, years=1, stdout=io.StringIO())
+
+        location = Location.objects.get(state=benchmarks.BENCH_STATE)
+        race = Race.objects.get(location=location)
+        self.assertEqual(Weather.objects.filter(location=location).count(), 24 * (366 if date.today().year % 4 == 1 else 365))
+        self.assertEqual(Climatology.objects.filter(location=location, month=race.date.month, day=race.date.day).count(), 24)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'baseline.json')
+            call_command('benchmark', repeat=1, save_baseline=path, stdout=io.StringIO())
+            with open(path) as f:
+                baseline = json.load(f)
+            self.assertEqual(set(baseline), {'index', 'race_weather', 'race_weather.cached', 'forecast.climatology', 'ingest.historic', 'convert.weather'})
+            # Benchmarks undo their writes
+            self.assertEqual(Weather.objects.filter(location=location, datetime__year=date.today().year + 1).count(), 0)
+
+            baseline['race_weather']['queries'] -= 1
+            with open(path, 'w') as f:
+                json.dump(baseline, f)
+            with self.assertRaisesMessage(CommandError, 'race_weather: '):
+                call_command('benchmark', repeat=1, baseline=path, tolerance=100, stdout=io.StringIO())
+
+    def test_compare_queries_only(self):
+        baseline = {'index': {'seconds': 0.001, 'queries': 2}}
+        slower = {'index': {'seconds': 0.01, 'queries': 2}}
+        self.assertEqual(len(benchmarks.compare(slower, baseline)), 1)
+        # Timings are left out, query counts are still checked
+        self.assertEqual(benchmarks.compare(slower, baseline, timings=False), [])
+        self.assertEqual(len(benchmarks.compare({'index': {'seconds': 0, 'queries': 3}}, baseline, timings=False)), 1)
+
+    def test_reads_cover_every_seeded_year(self):
+        call_command('seed_weather', locations=1, years=6, stdout=io.StringIO())
+        race = Race.objects.get(location__state=benchmarks.BENCH_STATE)
+
+        # Six years back is before HISTORY_START_YEAR, yet all of them are averaged
+        climatology = Climatology.objects.get(location=race.location, month=race.date.month, day=race.date.day, hour=12)
+        self.assertEqual(climatology.count, 6)
+
+        # Given the start year, the race page reads the same day in each of the other five years
+        request = RequestFactory().get(f'/weatherapp/race/{race.slug}')
+        with mock.patch.object(views, 'render_to_string', wraps=views.render_to_string) as render:
+            async_to_sync(views.race_weather)(request, slug=race.slug, start_year=race.date.year - 5)
+        context = render.call_args.args[1]
+        self.assertEqual({w.datetime.year for w in context['historic_weather']}, set(range(race.date.year - 5, race.date.year)))
+
+        # It is cached apart from the page with the default history
+        self.assertNotEqual(views.race_page_cache_key(race, race.date.year - 5), views.race_page_cache_key(race))
+
+    def test_benchmark_needs_seeded_data(self):
+        with self.assertRaisesMessage(CommandError, 'seed_weather'):
+            call_command('benchmark', repeat=1, stdout=io.StringIO())
+
+
+class FakeOpenMeteoTests(TestCase):
+
+    def setUp(self):
+        self.location = make_location()
+        self.race = Race.objects.create(
+            name='Boston Marathon', length='26.2', location=self.location,
+            date=datetime(2025, 4, 21, 14, tzinfo=dt_timezone.utc)
+        )
+        cache.stats.reset()
+        metrics.registry.reset()
+
+    def serve(self, **kwargs):
+        server = fake_openmeteo.FakeOpenMeteoServer(places=fake_openmeteo.places_from_locations([self.location]), **kwargs)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        settings_override = override_settings(OPENMETEO_CACHE_BACKEND='memory', OPENMETEO_RETRIES=0, **server.urls())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        clients.reset()
+        self.addCleanup(clients.reset)
+        return server
+
+    def test_historic_ingestion(self):
+        server = self.serve()
+
+        self.assertEqual(services.get_save_historic_weather(self.race), (96, 0))
+
+        self.assertEqual(server.responses, {200: 4})
+        self.assertEqual(cache.stats.snapshot()['historic.miss'], 4)
+        noon = Weather.objects.get(location=self.location, datetime=datetime(2024, 4, 21, 12, tzinfo=dt_timezone.utc))
+        self.assertTrue(0 < noon.temp < 100)
+        self.assertTrue(0 <= noon.humidity <= 100)
+
+    def test_geocoding(self):
+        self.serve()
+        Location.objects.filter(pk=self.location.pk).update(lat=0, long=0)
+        location = Location.objects.get(pk=self.location.pk)
+
+        located, failed = services.geocode_locations([location, make_location(city='Nowhere')])
+
+        self.assertEqual([(l.lat, l.long) for l in located], [(42.35843, -71.05977)])
+        self.assertEqual(len(failed), 1)
+
+    def test_injected_errors(self):
+        server = self.serve(error_rate=1)
+        with self.assertRaisesMessage(RuntimeError, 'too many 500 error responses'):
+            services.get_save_historic_weather(self.race)
+        self.assertEqual(server.responses, {500: 4})
+        counters, _ = metrics.registry.snapshot()
+        self.assertEqual(counters[('weatherapp_fetch_errors_total', (('kind', 'historic'), ('year', 2025)))], 1)
+
+        server.error_rate, server.throttle_rate = 0, 1
+        # 429s are retried after Retry-After; once retries run out the client raises
+        with self.assertRaisesMessage(OpenMeteoRequestsError, 'Too many requests'):
+            services.fetch_hourly(clients.get_client(), settings.OPENMETEO_FORECAST_URL, self.location, date(2025, 4, 21), date(2025, 4, 21))
+        self.assertEqual(server.responses, {500: 4, 429: 1})
+
+
+@override_settings(RACE_INDEX_PAGE_SIZE=2)
+class RaceIndexTests(TestCase):
+
+    def setUp(self):
+        django_cache.clear()
+        boston = make_location()
+        chicago = make_location(city='Chicago', state='Illinois')
+        today = timezone.now().replace(hour=14, minute=0, second=0, microsecond=0)
+        for name, location, length, days in [
+            ('Boston Marathon', boston, '26.2', 10),
+            ('Boston Half', boston, '13.1', 10),
+            ('Boston 10K', boston, '6.2', 40),
+            ('Chicago Marathon', chicago, '26.2', 20),
+            ('Chicago Half', chicago, '13.1', -30),
+            ('Boston Spring 5K', boston, '3.1', -60),
+        ]:
+            Race.objects.create(name=name, length=length, location=location, date=today + timedelta(days=days))
+
+    def names(self, response):
+        return [race.name for race in response.context['races']]
+
+    def test_upcoming_races_paged_by_date(self):
+        with self.assertNumQueries(1):
+            first = self.client.get('/weatherapp/')
+        self.assertEqual(self.names(first), ['Boston Marathon', 'Boston Half'])
+
+        second = self.client.get('/weatherapp/' + first.context['next_url'])
+        self.assertEqual(self.names(second), ['Chicago Marathon', 'Boston 10K'])
+        self.assertIsNone(second.context['next_url'])
+
+    def test_past_races_most_recent_first(self):
+        response = self.client.get('/weatherapp/', {'when': 'past'})
+        self.assertEqual(self.names(response), ['Chicago Half', 'Boston Spring 5K'])
+
+    def test_filters(self):
+        response = self.client.get('/weatherapp/', {'state': 'illinois'})
+        self.assertEqual(self.names(response), ['Chicago Marathon'])
+
+        response = self.client.get('/weatherapp/', {'distance': '26.2'})
+        self.assertEqual(self.names(response), ['Boston Marathon', 'Chicago Marathon'])
+
+        # Filters carry over to the next page
+        response = self.client.get('/weatherapp/', {'state': 'Massachusetts'})
+        self.assertIn('state=Massachusetts', response.context['next_url'])
+        self.assertEqual(self.names(self.client.get('/weatherapp/' + response.context['next_url'])), ['Boston 10K'])
+
+    def test_prefix_search_is_cached(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/weatherapp/', {'q': 'boston'})
+        self.assertEqual(self.names(response), ['Boston 10K', 'Boston Half'])
+        self.assertEqual(self.names(self.client.get('/weatherapp/', {'q': 'chicago m'})), ['Chicago Marathon'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names(self.client.get('/weatherapp/', {'q': 'BOSTON'})), ['Boston 10K', 'Boston Half'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/weatherapp/', {'after': 'nope'}).status_code, 400)
+
+
+class WeatherRetentionTests(TestCase):
+
+    def setUp(self):
+        self.location = make_location()
+        self.old_day = datetime(2024, 3, 10, tzinfo=dt_timezone.utc)
+        for hour in range(24):
+            dt = self.old_day + timedelta(hours=hour)
+            Weather.objects.create(location=self.location, datetime=dt, temp=40 + hour, precip=0.1, wind_gusts=hour, is_forecast=True)
+            # Observed history, kept as is
+            Weather.objects.create(location=self.location, datetime=dt + timedelta(days=365), temp=50, is_forecast=False)
+        # A recent forecast, still inside the retention window
+        Weather.objects.create(location=self.location, datetime=timezone.now() - timedelta(days=1), temp=60, is_forecast=True)
+
+    def test_rollup_forecasts(self):
+        call_command('rollup_forecasts', stdout=io.StringIO())
+
+        summary = DailyWeather.objects.get()
+        self.assertEqual((summary.location, summary.date, summary.hours), (self.location, date(2024, 3, 10), 24))
+        self.assertEqual((summary.temp_min, summary.temp_max, summary.temp), (40, 63, 51.5))
+        self.assertAlmostEqual(summary.precip, 2.4, places=4)
+        self.assertEqual(summary.wind_gusts, 23)
+
+        self.assertEqual(Weather.objects.filter(is_forecast=True).count(), 1)
+        self.assertEqual(Weather.objects.filter(is_forecast=False).count(), 24)
+        self.assertEqual(Location.objects.get(pk=self.location.pk).weather_version, 1)
+
+        # Nothing left to roll up
+        self.assertEqual(services.rollup_forecasts(), (0, 0))
+
+    @skipIf(connection.vendor == 'postgresql', "Weather is partitioned on Postgres")
+    def test_partitions_need_postgres(self):
+        out = io.StringIO()
+        call_command('create_weather_partitions', stdout=out)
+        self.assertIn("nothing to do", out.getvalue())
+
+    @skipUnless(connection.vendor == 'postgresql', "Partitioning is Postgres only")
+    def test_partitions_cover_backfilled_history(self):
+        def partition_of(weather):
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT tableoid::regclass::text FROM weatherapp_weather WHERE id = %s', [weather.pk])
+                return cursor.fetchone()[0]
+
+        # History older than the partitions lands in the default one
+        old = Weather.objects.create(location=self.location, datetime=datetime(2019, 6, 1, tzinfo=dt_timezone.utc), temp=50)
+        self.assertEqual(partition_of(old), partitions.DEFAULT_PARTITION)
+
+        call_command('create_weather_partitions', stdout=io.StringIO())
+
+        self.assertTrue({2019, 2020, 2021, services.HISTORY_START_YEAR} <= set(partitions.partition_years()))
+        self.assertEqual(partition_of(old), partitions.partition_name(2019))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Partitioning is Postgres only")
+class PartitionMigrationTests(TransactionTestCase):
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([('weatherapp', target)])
+        return executor.loader.project_state([('weatherapp', target)]).apps
+
+    def test_partitions_existing_rows(self):
+        apps = self.migrate('0013_dailyweather')
+        # Back to the latest migration, so later tests see the full schema
+        latest = MigrationExecutor(connection).loader.graph.leaf_nodes('weatherapp')[0][1]
+        self.addCleanup(self.migrate, latest)
+        Location = apps.get_model('weatherapp', 'Location')
+        Weather = apps.get_model('weatherapp', 'Weather')
+        location = Location.objects.create(city='Boston', state='Massachusetts', country='United States', lat=42.35843, long=-71.05977)
+        start = datetime(2021, 12, 31, tzinfo=dt_timezone.utc)
+        Weather.objects.bulk_create([Weather(location=location, datetime=start + timedelta(hours=i), temp=50) for i in range(72)])
+        last_id = Weather.objects.order_by('-pk').first().pk
+
+        apps = self.migrate('0014_partition_weather')
+
+        self.assertTrue(partitions.is_partitioned())
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT tableoid::regclass::text, COUNT(*) FROM weatherapp_weather GROUP BY 1 ORDER BY 1')
+            self.assertEqual(cursor.fetchall(), [(partitions.partition_name(2021), 24), (partitions.partition_name(2022), 48)])
+        # New rows still get ids, after the copied ones
+        Weather = apps.get_model('weatherapp', 'Weather')
+        added = Weather.objects.create(location_id=location.pk, datetime=start - timedelta(days=1), temp=50)
+        self.assertGreater(added.pk, last_id)
@@ -4,4 +4,9 @@ from . import views
 urlpatterns = [
     path("", views.index, name="index"),
     path('race/<slug:slug>', views.race_weather, name="race_weather"),
+    path('api/race/<slug:slug>/forecast', views.api_race_forecast, name="api_race_forecast"),
+    path('api/race/<slug:slug>/historic', views.api_race_historic, name="api_race_historic"),
+    path('api/race/<slug:slug>/climatology', views.api_race_climatology, name="api_race_climatology"),
+    path('js/plotly-<str:version>.min.js', views.plotly_js, name="plotly_js"),
+    path('metrics', views.ingestion_metrics, name="ingestion_metrics"),
 ]
\ No newline at end of file
@@ -1,30 +1,266 @@
-from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, aget_object_or_404, get_object_or_404
+from django.http import Http404, HttpResponse, JsonResponse
+from django.conf import settings
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.urls import reverse
 from django.utils import timezone
-from datetime import datetime, timedelta, timezone as dt_timezone 
-from django.db.models import Avg
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.html import json_script
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from functools import lru_cache
+from hashlib import md5
+from urllib.parse import urlencode
+from datetime import date, datetime, timedelta, timezone as dt_timezone 
+from django.db.models import Avg, Q
+from django.db.models.functions import Upper
 from collections import defaultdict
 from .models import *
+from . import metrics, refresh, services
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from plotly.offline import plot
+from plotly.offline import get_plotlyjs
+from plotly.utils import PlotlyJSONEncoder
 import plotly
 
-def index(request):
-    races = Race.objects.all()
+async def index(request):
+    """
+    Upcoming races by date, or past ones most recent first with when=past, a page at a time.
+    state and distance filter the list and q searches race names by prefix.
+    """
+    past = request.GET.get('when') == 'past'
+    filters = {
+        'state': request.GET.get('state', '').strip(),
+        'distance': request.GET.get('distance', '').strip(),
+    }
+    query = request.GET.get('q', '').strip()
+
+    next_url = None
+    if query:
+        races = await search_races(query, past, **filters)
+    else:
+        try:
+            cursor = parse_cursor(request.GET.get('after'))
+        except ValueError:
+            raise BadRequest("Invalid page cursor")
+        races, next_cursor = await race_page(past, cursor, **filters)
+        if next_cursor:
+            params = {'when': 'past' if past else '', **filters, 'after': next_cursor}
+            next_url = '?' + urlencode({name: value for name, value in params.items() if value})
 
     return render(request, 'weatherapp/index.html', {
         'races': races,
+        'past': past,
+        'query': query,
+        'next_url': next_url,
+        **filters,
     })
 
 
-def race_weather(request, slug):
-    race = get_object_or_404(Race, slug=slug)
+def race_listing(past, state='', distance=''):
+    """Upcoming or past races matching the filters, with only the fields the index shows"""
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    races = Race.objects.only('name', 'slug', 'date', 'length')
+    races = races.filter(date__lt=today) if past else races.filter(date__gte=today)
+    if state:
+        races = races.filter(location__state__iexact=state)
+    if distance:
+        races = races.filter(length=distance)
+    return races
+
+
+def format_cursor(race):
+    return f"{race.date.isoformat()},{race.pk}"
+
+
+def parse_cursor(cursor):
+    """(date, pk) of the last race on the previous page, or None for the first page"""
+    if not cursor:
+        return None
+    race_date, pk = cursor.rsplit(',', 1)
+    return datetime.fromisoformat(race_date), int(pk)
+
+
+async def race_page(past, cursor, **filters):
+    """
+    One page of race_listing after the cursor. Paged by keyset on (date, id) rather than
+    offset, so every page is a range read of race_date_id_idx however deep it is.
+    Returns (races, cursor of the next page or None).
+    """
+    races = race_listing(past, **filters)
+    if cursor:
+        race_date, pk = cursor
+        if past:
+            races = races.filter(Q(date__lt=race_date) | Q(date=race_date, pk__lt=pk))
+        else:
+            races = races.filter(Q(date__gt=race_date) | Q(date=race_date, pk__gt=pk))
+
+    size = settings.RACE_INDEX_PAGE_SIZE
+    ordering = ('-date', '-pk') if past else ('date', 'pk')
+    page = [race async for race in races.order_by(*ordering)[:size + 1]]
+
+    return page[:size], format_cursor(page[size - 1]) if len(page) > size else None
+
+
+async def search_races(query, past, **filters):
+    """
+    Races whose name starts with query, ignoring case, up to RACE_INDEX_PAGE_SIZE of them.
+    The prefix is read as a range of race_upper_name_idx, and each search is cached for
+    RACE_SEARCH_CACHE_TIMEOUT seconds.
+    """
+    prefix = query.upper()
+    key = 'race-search:' + md5(repr((prefix, past, sorted(filters.items()))).encode()).hexdigest()
+
+    races = await cache.aget(key)
+    if races is None:
+        # The range bounds the index scan; istartswith keeps exact matches under any collation
+        matches = race_listing(past, **filters).alias(upper_name=Upper('name')).filter(
+            upper_name__gte=prefix,
+            upper_name__lt=prefix[:-1] + chr(ord(prefix[-1]) + 1),
+            name__istartswith=query
+        )
+        races = [race async for race in matches.order_by('upper_name', 'date', 'pk')[:settings.RACE_INDEX_PAGE_SIZE]]
+        await cache.aset(key, races, settings.RACE_SEARCH_CACHE_TIMEOUT)
+
+    return races
+
+
+async def race_weather(request, slug, start_year=None):
+    """The race page, with history from start_year on (default HISTORY_START_YEAR)"""
+    race = await aget_object_or_404(Race.objects.select_related('location'), slug=slug)
+    etag, last_modified = race_validators(race, start_year)
+    refreshed = False
+
+    # Browsers and CDNs revalidate with If-None-Match / If-Modified-Since and get a 304 without a render
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        # The page only changes when the location's weather does, so the render is cached per weather version
+        html = await cache.aget(race_page_cache_key(race, start_year))
+        if html is None:
+            context = await race_page_context(race, start_year)
+
+            # Upcoming race with no forecast yet: fetch it now. Awaited, so the upstream call holds no worker thread
+            if not context['weather_forecast'] and services.in_forecast_window(race.date.date()):
+                race = await refresh_forecast(race)
+                refreshed = True
+                etag, last_modified = race_validators(race, start_year)
+                context = await race_page_context(race, start_year)
+
+            html = await sync_to_async(render_to_string)('weatherapp/race.html', context, request)
+            await cache.aset(race_page_cache_key(race, start_year), html, settings.RACE_PAGE_CACHE_TIMEOUT)
+        response = HttpResponse(html)
+
+    # A stale forecast is served as is and refreshed in the background. The new rows bump the
+    # weather version, so later requests get a fresh page
+    if not refreshed and services.forecast_is_stale(race):
+        await sync_to_async(refresh_forecast_in_background)(race)
+
+    return set_validators(response, etag, last_modified)
+
+
+def refresh_forecast_in_background(race):
+    """
+    Queue a refresh of the race's forecast unless another process or thread holds it.
+    Returns the Future, or None if the refresh was already taken.
+    """
+    claimed_at = services.claim_forecast_refresh(race)
+    if claimed_at is None:
+        return None
+    return refresh.refresh_in_background(
+        f"forecast:{race.pk}", services.get_save_forecast, race,
+        on_done=lambda: services.release_forecast_refresh(race, claimed_at)
+    )
+
+
+async def refresh_forecast(race):
+    """
+    Fetch and save the race's forecast, returning the race reloaded with its new weather version.
+    Skipped if a refresh of the race is already in flight.
+    """
+    claimed_at = await sync_to_async(services.claim_forecast_refresh)(race)
+    if claimed_at is None:
+        return race
+
+    try:
+        await services.aget_save_forecast(race)
+    except Exception as e:
+        print(f"Error fetching forecast for {race}: {e}")
+        return race
+    finally:
+        await sync_to_async(services.release_forecast_refresh)(race, claimed_at)
+    return await Race.objects.select_related('location').aget(pk=race.pk)
+
+
+def race_validators(race, start_year=None):
+    """ETag and Last-Modified timestamp for anything derived from the race's location weather"""
+    etag = quote_etag(md5(race_page_cache_key(race, start_year).encode()).hexdigest())
+    last_modified = race.location.weather_updated_at
+    return etag, int(last_modified.timestamp()) if last_modified else None
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+@lru_cache(maxsize=1)
+def plotly_js_bundle():
+    return get_plotlyjs()
+
+
+@gzip_page
+# No ETag for other versions, so they can't be answered with a 304 either
+@condition(etag_func=lambda request, version: plotly.__version__ if version == plotly.__version__ else None)
+def plotly_js(request, version):
+    """
+    The plotly.js bundle, served once per browser instead of inlined into every race page.
+    The URL carries the plotly version so the response can be cached for good; any other
+    version is a 404, as this bundle isn't it.
+    """
+    if version != plotly.__version__:
+        raise Http404("Unknown plotly.js version")
+    response = HttpResponse(plotly_js_bundle(), content_type='text/javascript; charset=utf-8')
+    patch_cache_control(response, public=True, max_age=365 * 24 * 3600, immutable=True)
+    return response
+
+
+def ingestion_metrics(request):
+    """Ingestion timings and counters of this process, in the Prometheus text format"""
+    if not metrics.enabled():
+        raise Http404("Metrics are turned off")
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in settings.WEATHER_METRICS_ALLOWED_IPS:
+        raise PermissionDenied
+    response = HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    patch_cache_control(response, no_store=True)
+    return response
+
+
+def plotly_js_url():
+    return settings.PLOTLY_JS_URL or reverse('plotly_js', args=[plotly.__version__])
+
+
+# Bump when race.html or race_page_context change what a page shows, so cached renders and
+# browser copies validated by ETag are replaced
+RACE_PAGE_VERSION = 1
+
+
+def race_page_cache_key(race, start_year=None):
+    # The plotly version is part of the page through plotly_js_url, whose old URLs stop working
+    return (
+        f"race-page:{RACE_PAGE_VERSION}:{plotly.__version__}:{start_year or services.HISTORY_START_YEAR}:"
+        f"{race.pk}:{race.slug}:{int(race.date.timestamp())}:{race.location_id}:{race.location.weather_version}"
+    )
 
-    print(f"Race date: {race.date}")
-    print(f"Race date (local): {timezone.localtime(race.date)}")
 
+async def race_page_context(race, start_year=None):
    # race_date = race.date.date()
    # race_time = race.date.time()
    # race_local = timezone.localtime(race.date)
@@ -36,59 +272,60 @@ def race_weather(request, slug):
     race_date_utc = race_utc.date()
     race_hour_utc = race_utc.hour
 
-    print(f"Race local: {race.date}")
-    print(f"Race UTC: {race_utc} (date: {race_date_utc}, hour: {race_hour_utc})")   
-
-    weather_forecast = Weather.objects.filter(
-        location=race.location,
-        datetime__date=race_date_utc
-    ).order_by('datetime')
-
-    print(f"Weather forecast records found: {weather_forecast.count()}")
+    # One query for the race day in every year, as UTC ranges so the (location, datetime) index is used.
+    # Split in memory into the race-day forecast, the start hour and the same day in other years
+    years = range(start_year or services.HISTORY_START_YEAR, max(race_date_utc.year, date.today().year) + 2)
+    # Sorted here: an ORDER BY lets SQLite walk the location's whole index instead of the ranges
+    same_day_weather = sorted([w async for w in Weather.objects.filter(
+        services.same_day_ranges(race_date_utc.month, race_date_utc.day, years),
+        location=race.location
+    )], key=lambda w: w.datetime)
 
+    weather_forecast = [w for w in same_day_weather if w.datetime.year == race_date_utc.year]
+    start_weather = next((w for w in weather_forecast if w.datetime.hour == race_hour_utc), None)
+    historic_weather = [w for w in same_day_weather if w.datetime.year != race_date_utc.year]
 
-    start_weather = Weather.objects.filter(
+    # Typical weather for the race day, one row per UTC hour
+    climatology = [c async for c in Climatology.objects.filter(
         location=race.location,
-        datetime__date=race_date_utc,
-        datetime__hour=race_hour_utc
-    ).order_by('datetime')
+        month=race_date_utc.month,
+        day=race_date_utc.day
+    ).order_by('hour')]
+    start_climatology = next((c for c in climatology if c.hour == race_hour_utc), None)
 
 
-    historic_weather = Weather.objects.filter(
-        location=race.location,
-        datetime__month=race_date_utc.month,
-        datetime__day=race_date_utc.day
-    ).exclude(
-        datetime__year=race_date_utc.year
-    ).order_by('datetime')
-
-    location_weather_all = Weather.objects.filter(
-        location=race.location,
-    ).order_by('datetime')
+    # pandas and Plotly are CPU-bound, so the figure is built off the event loop
+    forecast_graph = await sync_to_async(forecast_figure)(race, weather_forecast)
 
+    return {
+        'race': race,
+        'weather_forecast': weather_forecast,
+        'start_weather': start_weather,
+        'historic_weather': historic_weather,
+        'climatology': climatology,
+        'start_climatology': start_climatology,
+        'forecast_graph': forecast_graph,
+        'plotly_js_url': plotly_js_url()
+    }
 
 
+def forecast_figure(race, weather_forecast):
+    """The race-day forecast chart as a json_script of the Plotly figure, or None without forecast rows"""
     # Convert to DataFrame
-    if hasattr(weather_forecast, 'values'):
-        # If it's a QuerySet
-        wf_data = list(weather_forecast.values('datetime', 'temp', 'humidity', 'wind_speed', 'rain', 'precip_prob'))
-    else:
-        # If it's a list of Weather objects
-        wf_data = []
-        for weather in weather_forecast:
-            wf_data.append({
-                'datetime': weather.datetime,
-                'temp': weather.temp,
-                'humidity': weather.humidity,
-                'wind_speed': weather.wind_speed,
-                'rain': weather.rain,
-                'precip_prob': weather.precip_prob,
-            })
+    wf_data = []
+    for weather in weather_forecast:
+        wf_data.append({
+            'datetime': weather.datetime,
+            'temp': weather.temp,
+            'humidity': weather.humidity,
+            'wind_speed': weather.wind_speed,
+            'rain': weather.rain,
+            'precip_prob': weather.precip_prob,
+        })
     
     wf_df = pd.DataFrame(wf_data)
     
     # Create Plotly graph if we have data
-    forecast_graph = None
     if not wf_df.empty:
         # Convert datetime to local timezone for display
         wf_df['datetime_local'] = wf_df['datetime'].apply(lambda x: timezone.localtime(x))
@@ -137,17 +374,108 @@ def race_weather(request, slug):
             paper_bgcolor='#f0f0f0'
         )
         
-        # Convert to HTML
-        forecast_graph = plot(fig, output_type='div', include_plotlyjs=True)
-    
-    
-    
+        # Only the figure spec goes in the page, plotly.js itself is a separate cacheable script
+        return json_script(fig.to_plotly_json(), 'forecast-figure', encoder=PlotlyJSONEncoder)
+    return None
+
+
+# JSON API. Payloads are columnar: one array per field, read straight from values_list
+
+# Climatology carries a few summary columns on top of the weather fields
+API_FIELDS = services.WEATHER_FIELDS + ['count', 'temp_p10', 'temp_p90']
+
+
+def api_race_forecast(request, slug):
+    """Hourly weather on the race day in the race's year"""
+    return api_race_weather(request, slug, historic=False)
+
+
+def api_race_historic(request, slug):
+    """Hourly weather on the race's calendar day in every other year"""
+    return api_race_weather(request, slug, historic=True)
+
+
+def api_race_climatology(request, slug):
+    """Typical weather per UTC hour on the race's calendar day"""
+    return api_race_response(request, slug, lambda race, params: climatology_columns(race, **params))
+
+
+def api_race_weather(request, slug, historic):
+    return api_race_response(request, slug, lambda race, params: weather_columns(race, historic=historic, **params))
+
+
+def api_race_response(request, slug, columns):
+    race = get_object_or_404(Race.objects.select_related('location'), slug=slug)
+    try:
+        params = api_params(request)
+    except BadRequest as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    etag, last_modified = race_validators(race)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        race_utc = race.date.astimezone(dt_timezone.utc)
+        response = JsonResponse({
+            'race': race.slug,
+            'date': race_utc,
+            'location': race.location_id,
+            'columns': columns(race, params),
+        })
+    return set_validators(response, etag, last_modified)
+
+
+def api_params(request):
+    """Parse ?fields=temp,humidity&start_hour=12&end_hour=18 (UTC hours, end exclusive)"""
+    fields = request.GET.get('fields')
+    if fields:
+        fields = [f for f in fields.split(',') if f]
+        unknown = sorted(set(fields) - set(API_FIELDS))
+        if unknown:
+            raise BadRequest(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        fields = list(services.WEATHER_FIELDS)
+
+    try:
+        start_hour = int(request.GET.get('start_hour', 0))
+        end_hour = int(request.GET.get('end_hour', 24))
+    except ValueError:
+        raise BadRequest("start_hour and end_hour must be integers")
+    if not 0 <= start_hour < end_hour <= 24:
+        raise BadRequest("Hours must satisfy 0 <= start_hour < end_hour <= 24")
+
+    return {'fields': fields, 'start_hour': start_hour, 'end_hour': end_hour}
+
+
+def weather_columns(race, fields, start_hour, end_hour, historic):
+    # Summary columns only exist on Climatology
+    fields = [f for f in fields if f in services.WEATHER_FIELDS]
+    race_date_utc = race.date.astimezone(dt_timezone.utc).date()
+    if historic:
+        years = [y for y in range(services.HISTORY_START_YEAR, max(race_date_utc.year, date.today().year) + 2)
+                 if y != race_date_utc.year]
+    else:
+        years = [race_date_utc.year]
+
+    rows = sorted(Weather.objects.filter(
+        services.same_day_ranges(race_date_utc.month, race_date_utc.day, years, start_hour, end_hour),
+        location=race.location_id
+    ).values_list('datetime', *fields))
+    return to_columns(rows, ['datetime'] + fields)
+
+
+def climatology_columns(race, fields, start_hour, end_hour):
+    race_date_utc = race.date.astimezone(dt_timezone.utc).date()
+    rows = Climatology.objects.filter(
+        location=race.location_id,
+        month=race_date_utc.month,
+        day=race_date_utc.day,
+        hour__gte=start_hour,
+        hour__lt=end_hour
+    ).order_by('hour').values_list('hour', *fields)
+    return to_columns(rows, ['hour'] + fields)
 
-    return render(request, 'weatherapp/race.html', {
-        'race': race,
-        'weather_forecast': weather_forecast,
-        'start_weather': start_weather,
-        'historic_weather': historic_weather,
-        'forecast_graph': forecast_graph
 
-    })
\ No newline at end of file
+def to_columns(rows, names):
+    """Transpose value rows into {name: [values]}"""
+    columns = list(zip(*rows)) or [()] * len(names)
+    return {name: list(column) for name, column in zip(names, columns)}
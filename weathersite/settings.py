@@ -126,3 +126,108 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Open-Meteo
+
+# Longest date span fetched from the historical API in one request; race days
+# inside one span come back in a single response. Open-Meteo counts a request
+# as one call per two weeks of data, so one span across years of race days
+# costs far more quota than a request per day. Only days close together
+# (a race weekend) are merged
+HISTORIC_MAX_SPAN_DAYS = 14
+
+# Races refreshed at once by the admin actions, and the most fetches started per second
+REFRESH_MAX_WORKERS = 8
+REFRESH_RATE_LIMIT = 5
+
+# Race pages serve the stored forecast and refresh it in the background once it
+# is older than FORECAST_STALE_AFTER seconds. One refresh per race runs at a
+# time, across processes: it is claimed in Race.forecast_refresh_claimed_at, and
+# the claim lapses after REFRESH_LOCK_TIMEOUT seconds in case a worker dies
+FORECAST_STALE_AFTER = 3600
+FORECAST_REFRESH_WORKERS = 2
+REFRESH_LOCK_TIMEOUT = 300
+
+# Refresh jobs still running this many seconds after they were claimed are taken
+# to belong to a worker that died, and are marked failed so they can be queued again
+REFRESH_JOB_TIMEOUT = 3600
+
+# Geocoding lookups run at once when resolving a batch of locations
+GEOCODE_MAX_WORKERS = 8
+
+# Coordinates sent to Open-Meteo are rounded to this many degrees, about the
+# spacing of its finest weather model grid, so nearby locations share responses
+OPENMETEO_GRID_DEGREES = 0.025
+
+# Open-Meteo endpoints. Point them at `manage.py fake_openmeteo` to run ingestion
+# against a local stand-in
+OPENMETEO_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+OPENMETEO_HISTORIC_URL = "https://historical-forecast-api.open-meteo.com/v1/forecast"
+OPENMETEO_GEOCODING_URL = "https://geocoding-api.open-meteo.com/v1/search"
+
+# Shared HTTP session used for every Open-Meteo call. Timeout is (connect, read) seconds
+OPENMETEO_POOL_SIZE = 10
+OPENMETEO_TIMEOUT = (5, 30)
+OPENMETEO_RETRIES = 5
+
+# Open-Meteo response cache. Backend is 'sqlite', 'filesystem', 'memory' or 'django'
+# (the Django cache named by OPENMETEO_DJANGO_CACHE). The most recently used responses
+# are also kept in memory, up to OPENMETEO_CACHE_MEMORY_SIZE of them (0 turns this off)
+OPENMETEO_CACHE_BACKEND = 'sqlite'
+OPENMETEO_CACHE_NAME = '.cache'
+OPENMETEO_DJANGO_CACHE = 'default'
+OPENMETEO_CACHE_MEMORY_SIZE = 256
+
+# Cache lifetime in seconds per endpoint. Historic responses ending more than
+# OPENMETEO_HISTORY_FINAL_DAYS ago never expire
+OPENMETEO_CACHE_TTL = {
+    'geocoding': 30 * 24 * 3600,
+    'forecast': 3600,
+    'historic': 3600,
+}
+OPENMETEO_HISTORY_FINAL_DAYS = 7
+
+# Seconds a rendered race page stays cached. Ingestion bumps the location's
+# weather version, which invalidates it sooner
+RACE_PAGE_CACHE_TIMEOUT = 24 * 3600
+
+# Races per page of the index, and seconds a name search stays cached. New races
+# can take that long to show up in searches
+RACE_INDEX_PAGE_SIZE = 50
+RACE_SEARCH_CACHE_TIMEOUT = 300
+
+# Where race pages load plotly.js from. None serves the bundle from the
+# installed plotly package under a versioned, long-lived URL; set a CDN URL
+# to offload it
+PLOTLY_JS_URL = None
+
+# On Postgres Weather is partitioned by year. create_weather_partitions keeps
+# partitions this many years ahead. rollup_forecasts turns forecast rows older
+# than WEATHER_FORECAST_RETENTION_DAYS into daily summaries
+WEATHER_PARTITION_YEARS_AHEAD = 1
+WEATHER_FORECAST_RETENTION_DAYS = 30
+
+# Per-stage ingestion timings and counters, served in the Prometheus text format
+# at weatherapp/metrics to staff users and the addresses below. Turning them off
+# makes the instrumentation a no-op
+WEATHER_METRICS_ENABLED = True
+WEATHER_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Ingestion mostly runs in process_weather_jobs and backfill_weather, whose metrics
+# the web endpoint can't see. Given a path, they write theirs there for the
+# node_exporter textfile collector; use one .prom file per worker process
+WEATHER_METRICS_TEXTFILE = None
+
+# Each timed stage is also logged as one JSON line on the weatherapp.metrics
+# logger; raise it to INFO to see them
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'weatherapp.metrics': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}